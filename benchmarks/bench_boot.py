@@ -0,0 +1,57 @@
+"""Boot latency of main.py.
+
+Imports main in fresh interpreters (schedulers off) and reports the median of the step timings recorded by
+BootTimer, plus the slowest imports from python -X importtime.
+
+Usage (needs DATABASE_URL and ORIGIN set like for the app itself):
+    python benchmarks/bench_boot.py [--runs 5] [--top 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+BOOT_SCRIPT = 'import json, main; print(json.dumps(main.app.config["BOOT_TIMINGS"]))'
+
+
+def run_boot(extra_args=()):
+    env = dict(os.environ, START_SCHEDULERS='0')
+    return subprocess.run([sys.executable, *extra_args, '-c', BOOT_SCRIPT], cwd=ROOT_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+# To get the slowest imports (cumulative microseconds) from the -X importtime output
+def slowest_imports(stderr, top):
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to boot')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    reports = [json.loads(run_boot().stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+
+    print(f'median of {args.runs} boots (seconds):')
+    for step in reports[0]:
+        print(f'  {step:<22} {statistics.median(report[step] for report in reports):8.3f}')
+
+    print('slowest imports (cumulative seconds):')
+    for cumulative, name in slowest_imports(run_boot(['-X', 'importtime']).stderr, args.top):
+        print(f'  {name:<40} {cumulative / 1e6:8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Microbenchmark of the expense text preprocessing.
+
+Compares the original preprocess_text (kept below as legacy_preprocess_text) with the TextNormalizer
+used by flask_website.expense, after checking that both give exactly the same output.
+
+Usage (needs the nltk stopwords and punkt data):
+    python benchmarks/bench_preprocess_text.py [--repeat 5] [--number 2000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask_website.text_normalizer import TextNormalizer  # noqa: E402
+
+# Typical expense titles and descriptions, combined the same way as predict_expense_category
+SAMPLE_TITLES = [
+    'Grab', 'Starbucks', 'TNG reload', 'Electricity bill', 'Netflix subscription', 'Lunch with friends',
+    'Petrol Shell', 'Rent for March', 'Uniqlo T-shirts', 'Clinic visit', 'Car insurance', 'PTPTN loan',
+    'Haircut', 'Movie tickets', "Kid's daycare", 'Textbooks', 'LRT card top-up', 'Water bill',
+]
+SAMPLE_DESCRIPTIONS = [
+    None, 'ride to work', 'iced latte <b>venti</b>', 'monthly', 'cannot skip this one', 'gonna be late',
+    'paid with credit card, 3 items', 'Dinner @ Jalan Alor!!', 'semester 2 fees', 'weekly groceries & snacks',
+]
+
+
+# The original implementation of preprocess_text
+def legacy_preprocess_text(text):
+    text = re.sub(r'<.*?>', '', text)
+    text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
+    text = text.lower()
+    tokens = nltk.word_tokenize(text)
+    stop_words = set(stopwords.words('english'))
+    tokens = [word for word in tokens if word not in stop_words]
+    stemmer = PorterStemmer()
+    tokens = [stemmer.stem(word) for word in tokens]
+    return ' '.join(tokens)
+
+
+def build_corpus(size, seed=0):
+    rng = random.Random(seed)
+    return [f'{rng.choice(SAMPLE_TITLES)} {rng.choice(SAMPLE_DESCRIPTIONS)}' for _ in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs, the best one is reported')
+    parser.add_argument('--number', type=int, default=2000, help='number of texts preprocessed per run')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.number)
+    normalizer = TextNormalizer()
+
+    # The trained vectorizer depends on the exact output, so refuse to report a speedup if anything differs
+    for text in corpus + SAMPLE_TITLES + [str(description) for description in SAMPLE_DESCRIPTIONS]:
+        expected, actual = legacy_preprocess_text(text), normalizer.normalize(text)
+        if expected != actual:
+            sys.exit(f'Output mismatch for {text!r}: {expected!r} != {actual!r}')
+
+    legacy = min(timeit.repeat(lambda: [legacy_preprocess_text(text) for text in corpus],
+                               repeat=args.repeat, number=1))
+    normalized = min(timeit.repeat(lambda: [normalizer.normalize(text) for text in corpus],
+                                   repeat=args.repeat, number=1))
+
+    print(f'texts per run:          {len(corpus)}')
+    print(f'legacy preprocess_text: {legacy / len(corpus) * 1e6:9.2f} us/text')
+    print(f'TextNormalizer:         {normalized / len(corpus) * 1e6:9.2f} us/text')
+    print(f'speedup:                {legacy / normalized:9.1f}x')
+    print(f'stem cache:             {normalizer.cache_info()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,19 @@
 from datetime import timedelta
 from .resetBudgetAlert import start_scheduler
 from .predictExpense import start_predict_expense_scheduler
+from .scheduler_lease import start_leader_election
 from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from .boot_timing import BootTimer
+from .nltk_resources import find_missing_resources, download_resources, NLTK_DATA_DIR
+import click
+import logging
 import secrets
 import os
-import nltk
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -23,9 +27,15 @@ db = SQLAlchemy()
 # Create bcrypt object outside to be imported by other files
 bcrypt = Bcrypt()
 
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
 
 # To create the flask app with settings
-def create_app():
+# boot_timer, if given, is the timer started by the entry script so the import time is part of the report
+def create_app(boot_timer=None):
+    boot_timer = boot_timer or BootTimer()
+
     # Create Flask instance named app
     app = Flask(__name__)
 
@@ -46,15 +56,41 @@ def create_app():
 
     # Initialize bcrypt object, used for encrypt password and check password currently
     bcrypt.init_app(app)
-
-    # To start the scheduler to reset the budget model's is_exceed to 0 on the first day of every month at 12:00 AM
-    start_scheduler(db, app)
-
-    # To start the scheduler to predict the expense for each user's category on first day of every month at 12.15am
-    start_predict_expense_scheduler(db, app)
-
-    nltk.download('stopwords')
-    nltk.download('punkt')
+    boot_timer.mark('configure')
+
+    # The schedulers can be turned off for processes that only run commands, e.g. START_SCHEDULERS=0 flask ...
+    if os.getenv('START_SCHEDULERS', '1').lower() not in ('0', 'false', 'no'):
+        # To start the scheduler to clear the stale is_exceed flags of the budgets on the first day of every month
+        # at 12:00 AM
+        start_scheduler(db, app)
+
+        # To start the scheduler to predict the expense for each user's category on first day of every month at 12.15am
+        start_predict_expense_scheduler(db, app)
+
+        # To elect the one process of the cluster running the jobs above, renewing its lease while it is alive
+        start_leader_election(db, app)
+    boot_timer.mark('schedulers')
+
+    # To load the expense categorizer now instead of on the first prediction, used with gunicorn --preload so
+    # the workers forked afterwards share the loaded model
+    if os.getenv('PRELOAD_MODELS', '').lower() in ('1', 'true', 'yes'):
+        from .model_registry import categorizer_registry
+        categorizer_registry.preload()
+        boot_timer.mark('preload_models')
+
+    # Check the nltk data is available locally, it is never downloaded at startup, run the download-nltk-data
+    # command once instead
+    missing_resources = find_missing_resources()
+    if missing_resources:
+        logger.error(f'Missing nltk resources {", ".join(missing_resources)}, run "flask --app main '
+                     f'download-nltk-data" to download them into {NLTK_DATA_DIR}.')
+    boot_timer.mark('verify_nltk_data')
+
+    # To download the nltk resources used by the text preprocessing into the local data folder
+    @app.cli.command('download-nltk-data')
+    def download_nltk_data():
+        for name, downloaded in download_resources().items():
+            click.echo(f'{name}: {"downloaded" if downloaded else "failed"}')
 
     # To create tables for the database
     # from .models import User, Category, Expense, Budget, Notification
@@ -63,4 +99,6 @@ def create_app():
     #     # Create all tables
     #     db.create_all()
 
-    return app
\ No newline at end of file
+    app.config['BOOT_TIMINGS'] = boot_timer.report()
+
+    return app
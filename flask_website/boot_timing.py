@@ -0,0 +1,28 @@
+import logging
+import time
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+
+class BootTimer:
+    """Records how long each startup step takes, so the boot latency can be tracked as numbers."""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.steps = {}
+
+    # To record the time since the previous step under the given name
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps[step] = round(now - self._last, 4)
+        self._last = now
+
+    # To get the step timings and the total time since the timer started, in seconds
+    def report(self):
+        return dict(self.steps, total=round(self._last - self.started, 4))
+
+    def log(self, name):
+        timings = ', '.join(f'{step} {seconds:.3f}s' for step, seconds in self.report().items())
+        logger.info(f'{name} boot timings: {timings}')
@@ -1,8 +1,12 @@
-from datetime import datetime
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import extract
-from .models import User, Budget, Expense, Notification
+from sqlalchemy import func, and_, case
+from .models import Budget, Notification, Category, MonthlyExpenseTotal
+from .expense_filters import to_cents
+from .expense_rollup import get_monthly_total
+from .budget_alerts import parse_alert_thresholds, get_alert_thresholds, is_exceeded, alert_period
+from .time_window import current_year_month
+from .data_version import etag_versioned, bump_data_version, BUDGETS, EXPENSES, NOTIFICATIONS
 from . import db
 import logging
 
@@ -13,37 +17,50 @@ budget = Blueprint('budget', __name__)
 logger = logging.getLogger(__name__)
 
 
-# To get all the budgets related to the user
+# To get all the budgets related to the user, with the current month spending of each budget's category
+# The spending depends on the expenses and the current month as well, so they are part of the ETag
 @budget.route('')
 @jwt_required()
+@etag_versioned(BUDGETS, EXPENSES, scope=current_year_month)
 def get_all_budgets():
     try:
 
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
-
-        if user:
-
-            # Access budgets associated with the user
-            budgets = Budget.query.filter_by(user_id=user_id).all()
-
-            # Sort budgets by category name
-            sorted_budgets = sorted(budgets, key=lambda budget: budget.category.name)
-
-            # Serialize the budgets to JSON
-            serialized_budgets = [{
+        # Get the current year and month
+        current_year, current_month = current_year_month()
+
+        # Get the budgets with their category name and current month total in one query, sorted by category name
+        # The monthly totals are joined on their primary key, so each budget has at most one total
+        budgets = db.session.query(
+            Budget.id, Budget.amount, Budget.category_id, Category.name.label('category_name'), Budget.alert_thresholds,
+            func.coalesce(MonthlyExpenseTotal.total, 0).label('month_total')
+        ).join(Category, Budget.category_id == Category.id).outerjoin(MonthlyExpenseTotal, and_(
+            MonthlyExpenseTotal.user_id == Budget.user_id,
+            MonthlyExpenseTotal.category_id == Budget.category_id,
+            MonthlyExpenseTotal.year == current_year,
+            MonthlyExpenseTotal.month == current_month
+        )).filter(Budget.user_id == user_id).order_by(Category.name).all()
+
+        # Serialize the budgets to JSON, with the remaining amount and the percent of the budget used
+        serialized_budgets = []
+        for budget in budgets:
+            month_total = to_cents(budget.month_total)
+
+            serialized_budgets.append({
                 'id': budget.id,
                 'amount': budget.amount,
                 'category_id': budget.category_id,
-                'category_name': budget.category.name,
-            } for budget in sorted_budgets]
+                'category_name': budget.category_name,
+                'month_total': month_total,
+                'remaining': budget.amount - month_total,
+                'percent_used': round(float(month_total / budget.amount * 100), 2) if budget.amount else None,
+                'is_exceed': month_total >= budget.amount,
+                'alert_thresholds': get_alert_thresholds(budget),
+            })
 
-            return jsonify({'budgets': serialized_budgets}), 200
-        else:
-            return jsonify({'message': 'User not found'}), 404
+        return jsonify({'budgets': serialized_budgets}), 200
 
     except Exception as e:
         logger.error(e)
@@ -65,11 +82,21 @@ def add_budget():
         category_id = budget_data.get('category_id')
         amount = budget_data.get('amount')
 
+        # The alert thresholds are optional, e.g. [50, 80, 100], by default BUDGET_ALERT_THRESHOLDS is used
+        alert_thresholds = None
+        if budget_data.get('alert_thresholds') is not None:
+            try:
+                alert_thresholds = parse_alert_thresholds(budget_data.get('alert_thresholds'))
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
         # Create new budget object
-        new_budget = Budget(amount=amount, category_id=category_id, user_id=user_id)
+        new_budget = Budget(amount=amount, category_id=category_id, user_id=user_id,
+                            alert_thresholds=alert_thresholds)
 
         # Store the new budget in database, committing the transactions
         db.session.add(new_budget)
+        bump_data_version(user_id, BUDGETS)
         db.session.commit()
 
         return jsonify({'message': 'The budget has been successfully added.'}), 200
@@ -98,13 +125,26 @@ def update_budget(budget_id):
         category_id = budget_data.get('category_id')
         amount = budget_data.get('amount')
 
+        # A budget moved to another category has not notified any threshold of it yet
+        new_values = {
+            'category_id': category_id,
+            'amount': amount,
+            'alert_level': case((Budget.category_id == category_id, Budget.alert_level), else_=0)
+        }
+
+        # The alert thresholds are only changed when given, null goes back to the default thresholds
+        if 'alert_thresholds' in budget_data:
+            try:
+                new_values['alert_thresholds'] = parse_alert_thresholds(budget_data['alert_thresholds']) \
+                    if budget_data['alert_thresholds'] is not None else None
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
         # Update the budget
-        updated_budget = Budget.query.filter_by(id=budget_id, user_id=user_id).update(
-            {
-                'category_id': category_id,
-                'amount': amount
-            }
-        )
+        updated_budget = Budget.query.filter_by(id=budget_id, user_id=user_id).update(new_values)
+
+        if updated_budget:
+            bump_data_version(user_id, BUDGETS)
 
         # Commit the changes to the database
         db.session.commit()
@@ -133,6 +173,9 @@ def delete_budget(budget_id):
         # Delete the budget directly using a query
         deleted_budget = Budget.query.filter_by(id=budget_id, user_id=user_id).delete()
 
+        if deleted_budget:
+            bump_data_version(user_id, BUDGETS)
+
         # Commit the changes to the database
         db.session.commit()
 
@@ -160,16 +203,10 @@ def check_monthly_budget_with_expense():
         category_id = request.json.get('category_id')
 
         # Get the current year and month
-        current_year = datetime.now().year
-        current_month = datetime.now().month
+        current_year, current_month = current_year_month()
 
-        # Query expenses for the given user, category, and current year/month
-        total_expense = db.session.query(db.func.sum(Expense.amount)).filter(
-            Expense.user_id == user_id,
-            Expense.category_id == category_id,
-            extract('year', Expense.date) == current_year,
-            extract('month', Expense.date) == current_month
-        ).scalar() or 0
+        # Get the total expense of the given user, category, and current year/month from the monthly totals
+        total_expense, _ = get_monthly_total(user_id, category_id, current_year, current_month)
 
         # Query the budget for the given user and category
         budget = Budget.query.filter_by(user_id=user_id, category_id=category_id).first()
@@ -177,9 +214,10 @@ def check_monthly_budget_with_expense():
         if budget:
 
             # Compare total expense with the budget amount
-            if total_expense < budget.amount:
+            if total_expense < budget.amount and is_exceeded(budget, alert_period(current_year, current_month)):
                 # Reset is_exceed field of the budget to False
                 budget.is_exceed = False
+                bump_data_version(user_id, BUDGETS)
 
             db.session.commit()
 
@@ -196,6 +234,7 @@ def check_monthly_budget_with_expense():
                     user_id=user_id
                 )
                 db.session.add(notification)
+                bump_data_version(user_id, NOTIFICATIONS)
                 db.session.commit()
 
         return jsonify({'message': 'Monthly budget have been checked against the expense.'}), 200
@@ -0,0 +1,153 @@
+from .models import Budget, Notification
+from .expense_rollup import get_monthly_total
+from .time_window import current_year_month, local_year_month
+from .data_version import bump_data_version, BUDGETS, NOTIFICATIONS
+from . import db
+import os
+
+# Percents of the budget that notify the user when the month total reaches them, for budgets without their own
+# thresholds, e.g. BUDGET_ALERT_THRESHOLDS=50,80,100
+DEFAULT_ALERT_THRESHOLDS = os.getenv('BUDGET_ALERT_THRESHOLDS', '100')
+
+# Maximum number of thresholds of one budget, and the highest threshold percent
+MAX_ALERT_THRESHOLDS = 10
+MAX_ALERT_THRESHOLD = 1000
+
+
+# To parse the alert thresholds of a budget from a list of percents, or a comma separated string
+# Returns them as the comma separated string stored in Budget.alert_thresholds
+def parse_alert_thresholds(value):
+    parts = value.split(',') if isinstance(value, str) else value
+    try:
+        thresholds = sorted({int(part) for part in parts})
+    except (TypeError, ValueError):
+        raise ValueError('Invalid alert_thresholds, expected a list of percents.')
+
+    if not thresholds or len(thresholds) > MAX_ALERT_THRESHOLDS:
+        raise ValueError(f'Invalid alert_thresholds, expected 1 to {MAX_ALERT_THRESHOLDS} percents.')
+    if thresholds[0] < 1 or thresholds[-1] > MAX_ALERT_THRESHOLD:
+        raise ValueError(f'Invalid alert_thresholds, expected percents between 1 and {MAX_ALERT_THRESHOLD}.')
+
+    return ','.join(str(threshold) for threshold in thresholds)
+
+
+# To get the alert thresholds of a budget as a sorted list of percents
+def get_alert_thresholds(budget):
+    return [int(part) for part in (budget.alert_thresholds or DEFAULT_ALERT_THRESHOLDS).split(',')]
+
+
+# To encode a (year, month) as the integer stored in Budget.alert_period
+def alert_period(year, month):
+    return year * 100 + month
+
+
+# To get whether a budget is exceeded in the given period, its is_exceed flag only holds for its alert_period
+def is_exceeded(budget, period):
+    return bool(budget.is_exceed) and budget.alert_period == period
+
+
+# To build the title and message of the notification of a budget reaching a threshold
+def _threshold_notification(budget, threshold, total_expense):
+    category_name = budget.category.name
+
+    if threshold == 100 and total_expense == budget.amount:
+        return 'Budget Reached', f'Your expenses in category {category_name} have reached the budget limit.'
+    if threshold == 100:
+        return 'Budget Exceeded', f'Your expenses in category {category_name} have exceeded the budget.'
+    return f'Budget Alert: {threshold}% Used', \
+        f'Your expenses in category {category_name} have reached {threshold}% of the budget this month.'
+
+
+# To check the current month expense of a category against its budget, without committing, so it is part of
+# the caller's transaction. It reads the monthly total and the budget, whatever the number of expenses
+# Notifies the highest threshold newly reached, each threshold at most once per month, updates is_exceed, and
+# returns the month total with the budget status
+def evaluate_expense_budget(user_id, category_id):
+    # Get the current year and month
+    current_year, current_month = current_year_month()
+    period = alert_period(current_year, current_month)
+
+    # Get the total expense of the given user, category, and current year/month from the monthly totals
+    total_expense, _ = get_monthly_total(user_id, category_id, current_year, current_month)
+
+    status = {
+        'category_id': category_id,
+        'year': current_year,
+        'month': current_month,
+        'month_total': total_expense,
+        'budget_amount': None,
+        'is_exceed': False,
+        'alert_level': 0,
+        'status': 'no_budget',
+    }
+
+    # Query the budget for the given user and category, locked until the commit so concurrent expenses
+    # cannot both see a threshold as not notified and notify twice
+    budget = Budget.query.filter_by(user_id=user_id, category_id=category_id).with_for_update().first()
+
+    if budget is None:
+        return status
+
+    # The flag and thresholds of a previous month do not count in this one
+    is_exceed_value = is_exceeded(budget, period)
+    if budget.alert_period != period:
+        budget.alert_level = 0
+        budget.alert_period = period
+
+    # Compare total expense with the budget amount, and update is_exceed field of the budget
+    budget.is_exceed = total_expense >= budget.amount
+    if budget.is_exceed != is_exceed_value:
+        bump_data_version(user_id, BUDGETS)
+
+    # Notify the highest threshold reached above the ones already notified this month, one notification when
+    # an expense crosses several thresholds at once
+    if budget.amount > 0:
+        percent_used = total_expense * 100 / budget.amount
+        reached = [threshold for threshold in get_alert_thresholds(budget) if percent_used >= threshold]
+
+        if reached and reached[-1] > budget.alert_level:
+            title, message = _threshold_notification(budget, reached[-1], total_expense)
+
+            notification = Notification(
+                title=title,
+                message=message,
+                user_id=user_id
+            )
+            db.session.add(notification)
+            bump_data_version(user_id, NOTIFICATIONS)
+
+            budget.alert_level = reached[-1]
+
+    if total_expense > budget.amount:
+        status['status'] = 'exceeded'
+    elif total_expense == budget.amount:
+        status['status'] = 'reached'
+    else:
+        status['status'] = 'under'
+
+    status.update(budget_amount=budget.amount, is_exceed=budget.is_exceed, alert_level=budget.alert_level)
+
+    return status
+
+
+# To get the budget status of a user's category from the statuses returned by apply_budget_alerts, only
+# evaluating it when the change did not touch the current month, so the budget is not locked and read twice
+def get_budget_status(budget_statuses, user_id, category_id):
+    status = budget_statuses.get((int(user_id), int(category_id)))
+    if status is None:
+        status = evaluate_expense_budget(user_id, category_id)
+    return status
+
+
+# To evaluate the budgets whose current month total changed with the removed and added expenses, in the
+# caller's transaction. Both are lists of ExpenseSnapshot
+# Returns the budget status of each evaluated (user_id, category_id)
+def apply_budget_alerts(removed, added):
+    current = current_year_month()
+
+    # Changes to other months leave the current month totals, and so the alerts, as they are
+    touched = sorted({(int(expense.user_id), int(expense.category_id)) for expense in removed + added
+                      if local_year_month(expense.date) == current})
+
+    return {(user_id, category_id): evaluate_expense_budget(user_id, category_id)
+            for user_id, category_id in touched}
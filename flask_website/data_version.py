@@ -0,0 +1,94 @@
+from functools import wraps
+from flask import request, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from .models import DataVersion
+from . import db
+import hashlib
+
+# The resource lists with a version, one per list endpoint
+EXPENSES = 'expenses'
+BUDGETS = 'budgets'
+NOTIFICATIONS = 'notifications'
+CATEGORIES = 'categories'
+
+# The user id of the versions shared by every user
+GLOBAL_USER_ID = 0
+
+
+# To build the statement increasing the version of a resource, creating the row if it does not exist
+# It takes user_id, resource and version (1 for a new row) as parameters, so it can be run for many rows at once
+def _increment_statement():
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql.insert(DataVersion)
+        return statement.on_duplicate_key_update(version=DataVersion.version + 1)
+
+    insert_module = postgresql if dialect == 'postgresql' else sqlite
+    statement = insert_module.insert(DataVersion)
+    return statement.on_conflict_do_update(index_elements=['user_id', 'resource'],
+                                           set_={'version': DataVersion.version + 1})
+
+
+# To mark resource lists of a user as changed, without committing, so it is part of the caller's transaction
+# Use GLOBAL_USER_ID for a change to every user's list
+def bump_data_version(user_id, *resources):
+    for resource in resources:
+        db.session.execute(_increment_statement(), {'user_id': int(user_id), 'resource': resource, 'version': 1})
+
+
+# To mark a resource list of many users as changed with one executemany statement, without committing
+def bump_data_versions(user_ids, resource):
+    # Sorted so concurrent bumps lock the rows in the same order
+    rows = [{'user_id': user_id, 'resource': resource, 'version': 1}
+            for user_id in sorted({int(user_id) for user_id in user_ids})]
+    if rows:
+        db.session.execute(_increment_statement(), rows)
+
+
+# To get the versions of resource lists of a user, together with the shared versions, in one query
+def get_data_versions(user_id, resources):
+    rows = db.session.query(DataVersion.user_id, DataVersion.resource, DataVersion.version).filter(
+        DataVersion.user_id.in_([int(user_id), GLOBAL_USER_ID]),
+        DataVersion.resource.in_(resources)
+    )
+    versions = {(row.user_id, row.resource): row.version for row in rows}
+
+    return [(versions.get((int(user_id), resource), 0), versions.get((GLOBAL_USER_ID, resource), 0))
+            for resource in resources]
+
+
+# To compute the ETag of a list response from the versions it depends on, the query string and the extra
+# value, if any
+def compute_etag(user_id, resources, extra=None):
+    key = f'{user_id}|{get_data_versions(user_id, resources)}|{request.query_string.decode()}|{extra}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# Decorator for a GET route under jwt_required that returns the list of the given resources. It answers
+# 304 Not Modified when the If-None-Match header holds the current ETag, without running the route, and
+# sets the ETag on successful responses
+# scope, if given, is a function whose result is part of the ETag, for responses that also change with time,
+# e.g. current_year_month for a response about the current month
+def etag_versioned(*resources, scope=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(get_jwt_identity(), resources, scope() if scope else None)
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            # Let the browser store the response, but always check the ETag before using it
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        return wrapper
+
+    return decorator
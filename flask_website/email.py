@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import User
+from flask_jwt_extended import jwt_required
+from .identity import current_user_profile
 import logging
 import mailtrap as mt
 import os
@@ -18,14 +18,11 @@ logger = logging.getLogger(__name__)
 def get_email():
     try:
 
-        # Get the current user id
-        user_id = get_jwt_identity()
-
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
+        # Get the profile of the current user, cached between requests
+        user = current_user_profile()
 
         if user:
-            email = user.email
+            email = user['email']
 
             return jsonify({'email': email}), 200
         else:
@@ -41,12 +38,13 @@ def get_email():
 @jwt_required()
 def send_support_email():
     try:
-        # Get the current user id
-        user_id = get_jwt_identity()
+        # Get the profile of the current user, cached between requests
+        user = current_user_profile()
+
+        if user is None:
+            return jsonify({'message': 'Account not found.'}), 404
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
-        username = user.username
+        username = user['username']
 
         # Get email data to be sent in json format
         email_data = request.json
@@ -1,16 +1,31 @@
-from datetime import datetime
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import desc, extract
-from .models import User, Expense, Category, Budget, Notification
+from sqlalchemy import desc
+from .models import Expense, Category
+from .expense_filters import parse_expense_filters, apply_expense_filters, parse_page_size, apply_cursor, \
+    encode_cursor, parse_datetime, to_cents, parse_category_id
+from .expense_import import detect_format, import_expenses
+from .expense_export import EXPORT_FORMATS, iter_export
+from .expense_bulk import parse_bulk_selection, parse_bulk_changes, bulk_update_expenses, bulk_delete_expenses
+from .expense_sync import snapshot, sync_expense_changes
+from .expense_rollup import rebuild_rollup, verify_rollup
+from .expense_analytics import parse_analytics_options, expense_analytics
+from .expense_search import parse_search_query, search_expenses_query, apply_search_cursor, order_search_results, \
+    encode_search_cursor, rebuild_search_index
+from .budget_alerts import evaluate_expense_budget, get_budget_status
+from .predictExpense import train_and_predict_expenses
+from .time_window import current_year_month
+from .data_version import etag_versioned, EXPENSES, CATEGORIES
+from .text_normalizer import text_normalizer
+from .prediction_cache import PredictionCache
+from .model_registry import categorizer_registry
+from .inference_batcher import MicroBatcher
 from . import db
+import click
 import logging
 import os
-import joblib
-import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
+import sys
+import numpy as np
 
 # Create Blueprint object
 expense = Blueprint('expense', __name__)
@@ -18,59 +33,118 @@ expense = Blueprint('expense', __name__)
 # Get a logger for logging
 logger = logging.getLogger(__name__)
 
-# Get the directory path of the current script (app.py)
-current_dir = os.path.dirname(__file__)
+# Cache of the predictions by preprocessed text, cleared automatically when the model version changes
+prediction_cache = PredictionCache(max_size=int(os.getenv('PREDICTION_CACHE_SIZE', 10000)),
+                                   ttl=float(os.getenv('PREDICTION_CACHE_TTL', 3600)))
 
-# Define the path to the folder containing the model file
-models_dir = os.path.join(current_dir, 'machine_learning_models', 'categorize_expense')
 
-# Specify the path to the model file
-model_file_path = os.path.join(models_dir, 'nb_model.pkl')
+# To vectorize and predict many preprocessed texts at once, used by the micro-batching inference queue
+def predict_preprocessed_batch(preprocessed_texts):
+    categorizer = categorizer_registry.get()
 
-# Specify the vectorizer file
-vectorizer_file_path = os.path.join(models_dir, 'vectorizer.pkl')
+    return categorizer.nb_model.predict(categorizer.vectorizer.transform(preprocessed_texts))
 
-# Load the trained model and vectorizer
-nb_model = joblib.load(model_file_path)
-vectorizer = joblib.load(vectorizer_file_path)
 
-
-# Download the required resources, one time only
-# nltk.download('stopwords')
-# nltk.download('punkt')
+# Queue that groups concurrent single predictions into one transform and predict call. It only helps when a
+# worker serves requests concurrently (threaded or gthread workers), so it is off unless a window is set
+CATEGORIZER_BATCH_WINDOW_MS = float(os.getenv('CATEGORIZER_BATCH_WINDOW_MS', 0))
+categorizer_batcher = MicroBatcher(predict_preprocessed_batch,
+                                   max_batch_size=int(os.getenv('CATEGORIZER_MAX_BATCH_SIZE', 64)),
+                                   window=CATEGORIZER_BATCH_WINDOW_MS / 1000)
 
 
 # To preprocess the text before use in machine learning model
 def preprocess_text(text):
-    # Remove HTML tags
-    text = re.sub(r'<.*?>', '', text)
+    return text_normalizer.normalize(text)
+
+
+# Maximum number of items accepted by one batch prediction request
+MAX_PREDICT_BATCH_SIZE = 1000
+
+
+# To preprocess and vectorize many "title description" texts with one sparse transform call
+def vectorize_texts(categorizer, combined_texts):
+    return categorizer.vectorizer.transform([preprocess_text(text) for text in combined_texts])
+
+
+# To predict the category names of many texts with one transform and one predict call
+def predict_categories(combined_texts):
+    categorizer = categorizer_registry.get()
+
+    return list(categorizer.nb_model.predict(vectorize_texts(categorizer, combined_texts)))
+
+
+# To get the top_k most likely categories with their probabilities for each row of a vectorized matrix
+def top_categories(nb_model, texts_vectorized, top_k):
+    probabilities = nb_model.predict_proba(texts_vectorized)
 
-    # Remove non-alphanumeric characters
-    text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
+    # Column indexes of the top_k probabilities of each row, highest first
+    top_k = min(top_k, len(nb_model.classes_))
+    top_indexes = np.argsort(-probabilities, axis=1, kind='stable')[:, :top_k]
 
-    # Convert to lowercase
-    text = text.lower()
+    return [[{
+        'category': nb_model.classes_[index],
+        'probability': round(float(row_probabilities[index]), 4)
+    } for index in row_indexes] for row_probabilities, row_indexes in zip(probabilities, top_indexes)]
 
-    # Tokenize the text
-    tokens = nltk.word_tokenize(text)
 
-    # Remove stop words
-    stop_words = set(stopwords.words('english'))
-    tokens = [word for word in tokens if word not in stop_words]
+# To recompute the monthly totals from the expenses, for every user or only one
+@expense.cli.command('rebuild-rollup')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the monthly totals of this user.')
+def rebuild_rollup_command(user_id):
+    rows = rebuild_rollup(user_id)
+    click.echo(f'Monthly totals rebuilt, {rows} rows written.')
 
-    # Stem the words
-    stemmer = PorterStemmer()
-    tokens = [stemmer.stem(word) for word in tokens]
 
-    # Join the tokens back into a single string
-    preprocessed_text = ' '.join(tokens)
+# To compare the monthly totals with the expenses, exits with status 1 if they differ
+@expense.cli.command('verify-rollup')
+@click.option('--user-id', type=int, default=None, help='Only verify the monthly totals of this user.')
+@click.option('--year', type=int, default=None, help='Only verify this year and month (use with --month).')
+@click.option('--month', type=int, default=None, help='Only verify this year and month (use with --year).')
+def verify_rollup_command(user_id, year, month):
+    differences = verify_rollup(user_id, year, month)
+    for difference in differences[:20]:
+        click.echo(f"(user, category, year, month) {difference['key']}: expected (total, count) "
+                   f"{difference['expected']}, found {difference['actual']}")
 
-    return preprocessed_text
+    if differences:
+        click.echo(f'{len(differences)} monthly totals differ from the expenses.')
+        sys.exit(1)
+    click.echo('Monthly totals match the expenses.')
+
+
+# To recompute the search index from the expenses, for every user or only one
+@expense.cli.command('rebuild-search-index')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the search index of this user.')
+def rebuild_search_index_command(user_id):
+    rows = rebuild_search_index(user_id)
+    click.echo(f'Search index rebuilt, {rows} rows written.')
+
+
+# To run the monthly expense prediction now, e.g. to resume a run that stopped, only the shards not done yet
+# this month are run
+@expense.cli.command('predict-expenses')
+@click.option('--workers', type=int, default=None, help='Number of processes running the shards.')
+@click.option('--shard-size', type=int, default=None, help='Number of users per shard.')
+def predict_expenses_command(workers, shard_size):
+    totals = train_and_predict_expenses(db, current_app._get_current_object(), workers, shard_size)
+    click.echo(f"{totals['shards']} shards run, {totals['budgets']} budgets predicted, "
+               f"{totals['notified']} notified, {totals['failed']} shards failed.")
+    if totals['failed']:
+        sys.exit(1)
+
+
+# To write the categorizer as memory-mappable arrays, loaded when CATEGORIZER_FORMAT=arrays
+@expense.cli.command('export-model-arrays')
+def export_model_arrays():
+    arrays_dir = categorizer_registry.export_arrays()
+    click.echo(f'Model arrays written to {arrays_dir}')
 
 
 # To get the expense category list
 @expense.route('/get-expense-category-list')
 @jwt_required()
+@etag_versioned(CATEGORIES)
 def get_category_list():
     try:
 
@@ -100,22 +174,38 @@ def add_expense():
         # Get expense data to be store from request
         expense_data = request.json
 
-        # Get each data from the request
+        # Get each data from the request, the date is stored in UTC, the amount in cents and the category_id as
+        # an integer
         title = expense_data.get('title')
-        date = datetime.fromisoformat(expense_data.get('date'))
-        amount = expense_data.get('amount')
-        category_id = expense_data.get('category_id')
         description = expense_data.get('description')
+        try:
+            date = parse_datetime(expense_data.get('date'), 'date')
+            amount = to_cents(expense_data.get('amount'))
+            category_id = parse_category_id(expense_data.get('category_id'))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
 
         # Create new expense object
         new_expense = Expense(title=title, date=date, amount=amount, category_id=category_id,
                               description=description, user_id=user_id)
 
-        # Store the new expense in database, committing the transactions
+        # Store the new expense in database, flushed to get its id, and update the monthly totals, search index
+        # and budget alerts
         db.session.add(new_expense)
+        db.session.flush()
+        budget_statuses = sync_expense_changes(added=[snapshot(new_expense)])
+
+        response = {'message': 'The expense has been successfully added.'}
+
+        # With check_budget, also return the category budget status, so the client does not need to call
+        # /check-monthly-expense afterwards
+        if expense_data.get('check_budget'):
+            response['budget_status'] = get_budget_status(budget_statuses, user_id, category_id)
+
+        # Committing the transactions
         db.session.commit()
 
-        return jsonify({'message': 'The expense has been successfully added.'}), 200
+        return jsonify(response), 200
 
     except Exception as e:
         # Rollback changes if an error occurs
@@ -125,37 +215,245 @@ def add_expense():
         return jsonify({'message': 'An error occurred while adding expense.'}), 500
 
 
-# To get all the expenses related to the user
+# To import many expenses from a CSV or NDJSON upload
+# The file is sent as multipart form data (field "file") or as the raw request body
+# Query parameters:
+#   format           - csv or ndjson, detected from the file name or content type if not given
+#   auto_categorize  - true to predict the category of rows without category_id or category
+@expense.route('/import-expenses', methods=['POST'])
+@jwt_required()
+def import_expenses_file():
+    try:
+        # Get the current user id
+        user_id = get_jwt_identity()
+
+        # Use the uploaded file if there is one, else read the request body as a stream
+        upload = request.files.get('file')
+        if upload:
+            stream, filename, content_type = upload.stream, upload.filename, upload.content_type
+        else:
+            stream, filename, content_type = request.stream, None, request.content_type
+
+        try:
+            upload_format = detect_format(request.args.get('format'), filename, content_type)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        auto_categorize = request.args.get('auto_categorize', '').lower() in ('1', 'true', 'yes')
+
+        report = import_expenses(stream, upload_format, user_id,
+                                 predict_categories=predict_categories if auto_categorize else None)
+
+        # An upload that could not be read to its end is a bad request, the report tells which rows were imported
+        if report['stopped_at_row'] is not None:
+            return jsonify(report), 400
+
+        return jsonify(report), 200
+
+    except Exception as e:
+        # Rollback changes if an error occurs
+        db.session.rollback()
+
+        logger.error(e)
+        return jsonify({'message': 'An error occurred while importing expenses.'}), 500
+
+
+# To download the user's expenses as a file, streamed from the database so memory use does not grow with the
+# number of rows
+# Query parameters:
+#   format                  - csv (default) or ndjson
+#   compress                - gzip to compress the file
+#   start_date, end_date, category_id, min_amount, max_amount - the same filters as GET /expense
+@expense.route('/export')
+@jwt_required()
+def export_expenses():
+    try:
+        # Get the current user id
+        user_id = get_jwt_identity()
+
+        # Read the format, compression and filters from the query string
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'message': f"Invalid format, expected one of {', '.join(EXPORT_FORMATS)}."}), 400
+
+        compress = request.args.get('compress', '').lower() == 'gzip'
+
+        try:
+            filters = parse_expense_filters(request.args)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        filename = f'expenses.{export_format}' + ('.gz' if compress else '')
+        mimetype = 'application/gzip' if compress else EXPORT_FORMATS[export_format]
+
+        # The generator keeps the request context, and the database session with it, until the last chunk
+        return Response(stream_with_context(iter_export(user_id, filters, export_format, compress)),
+                        mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+    except Exception as e:
+        logger.error(e)
+        return jsonify({'message': str(e)}), 500
+
+
+# To get the expenses related to the user, one page at a time
+# Query parameters:
+#   limit                   - page size (default 50, max 200)
+#   cursor                  - next_cursor returned by the previous page
+#   start_date, end_date    - ISO 8601 dates, start_date <= date < end_date
+#   category_id             - one or more category ids (repeated or comma separated)
+#   min_amount, max_amount  - inclusive amount range
 @expense.route('')
 @jwt_required()
+@etag_versioned(EXPENSES)
 def get_all_expenses():
     try:
 
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
+        # Read the page size, cursor and filters from the query string
+        try:
+            limit = parse_page_size(request.args)
+            filters = parse_expense_filters(request.args)
+            cursor = request.args.get('cursor')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Select the expense columns together with the category name in one joined query
+        query = db.session.query(
+            Expense.id, Expense.title, Expense.date, Expense.amount,
+            Expense.category_id, Category.name.label('category_name'), Expense.description
+        ).join(Category, Expense.category_id == Category.id).filter(Expense.user_id == user_id)
+
+        query = apply_expense_filters(query, filters)
+
+        # Continue after the last expense of the previous page
+        if cursor:
+            try:
+                query = apply_cursor(query, cursor)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
+        # Order by date in descending order, id breaks the ties so the cursor position is unique
+        # Fetch one extra row to know whether there is a next page
+        rows = query.order_by(desc(Expense.date), desc(Expense.id)).limit(limit + 1).all()
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        # Serialize the expenses to JSON
+        serialized_expenses = [{
+            'id': row.id,
+            'title': row.title,
+            'date': row.date,
+            'amount': row.amount,
+            'category_id': row.category_id,
+            'category_name': row.category_name,
+            'description': row.description
+        } for row in rows]
+
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id) if has_next else None
+
+        return jsonify({'expenses': serialized_expenses, 'next_cursor': next_cursor}), 200
+
+    except Exception as e:
+        logger.error(e)
+        return jsonify({'message': str(e)}), 500
 
-        if user:
 
-            # Access expenses associated with the user, and order by date in descending order
-            expenses = Expense.query.filter_by(user_id=user_id).order_by(desc(Expense.date)).all()
+# To search the user's expenses by words of their title and description, best match first
+# Query string arguments:
+#   q                       - the words to search for, normalized like the category prediction text
+#   match                   - any (default, ranked by the number of matched words) or all
+#   limit, cursor           - page size and the next_cursor of the previous page
+#   start_date, end_date, category_id, min_amount, max_amount - the same filters as GET /expense
+@expense.route('/search')
+@jwt_required()
+@etag_versioned(EXPENSES)
+def search_expenses():
+    try:
 
-            # Serialize the expenses to JSON
-            serialized_expenses = [{
-                'id': expense.id,
-                'title': expense.title,
-                'date': expense.date,
-                'amount': expense.amount,
-                'category_id': expense.category_id,
-                'category_name': expense.category.name,
-                'description': expense.description
-            } for expense in expenses]
+        # Get the current user id
+        user_id = get_jwt_identity()
 
-            return jsonify({'expenses': serialized_expenses}), 200
-        else:
-            return jsonify({'message': 'User not found'}), 404
+        # Read the words, page size, cursor and filters from the query string
+        try:
+            tokens = parse_search_query(request.args.get('q'))
+            limit = parse_page_size(request.args)
+            filters = parse_expense_filters(request.args)
+            cursor = request.args.get('cursor')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Find the matching expenses through the token index, counting the matched words of each
+        query, rank = search_expenses_query(user_id, tokens, match_all=request.args.get('match') == 'all')
+        query = apply_expense_filters(query, filters)
+
+        # Continue after the last match of the previous page
+        if cursor:
+            try:
+                query = apply_search_cursor(query, rank, cursor)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
+        # Fetch one extra row to know whether there is a next page
+        rows = order_search_results(query, rank).limit(limit + 1).all()
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        # Serialize the matches to JSON
+        serialized_expenses = [{
+            'id': row.id,
+            'title': row.title,
+            'date': row.date,
+            'amount': row.amount,
+            'category_id': row.category_id,
+            'category_name': row.category_name,
+            'description': row.description,
+            'rank': row.rank
+        } for row in rows]
+
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].date, rows[-1].id) if has_next else None
+
+        return jsonify({'expenses': serialized_expenses, 'next_cursor': next_cursor}), 200
+
+    except Exception as e:
+        logger.error(e)
+        return jsonify({'message': str(e)}), 500
+
+
+# To get the spending analytics of the user, aggregated in the database instead of the browser
+# Optional query string arguments:
+#   from, to     - inclusive range of local months as YYYY-MM, by default the last 12 months
+#   granularity  - month or year, the size of the periods in by_period
+#   top_n        - number of titles in top_titles (default 10, at most 50)
+#   category_id  - one or more category ids (repeated or comma separated)
+@expense.route('/analytics')
+@jwt_required()
+@etag_versioned(EXPENSES, scope=current_year_month)
+def get_expense_analytics():
+    try:
+
+        # Get the current user id
+        user_id = get_jwt_identity()
+
+        # Read the range, granularity, top_n and categories from the query string
+        try:
+            filters = parse_expense_filters(request.args)
+
+            # The analytics are computed from the monthly totals, which cannot be filtered by date or amount
+            unsupported = sorted(set(filters) - {'category_ids'})
+            if unsupported:
+                raise ValueError(f"Unsupported filters {', '.join(unsupported)}, the analytics are filtered by "
+                                 f"from, to and category_id.")
+
+            options = parse_analytics_options(request.args, filters.get('category_ids'))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        return jsonify(expense_analytics(user_id, options)), 200
 
     except Exception as e:
         logger.error(e)
@@ -173,31 +471,49 @@ def update_expense(expense_id):
         # Get expense data to be store from request
         expense_data = request.json
 
-        # Get each data from the request
+        # Get each data from the request, the date is stored in UTC, the amount in cents and the category_id as
+        # an integer
         title = expense_data.get('title')
-        date = datetime.fromisoformat(expense_data.get('date'))
-        amount = expense_data.get('amount')
-        category_id = expense_data.get('category_id')
         description = expense_data.get('description')
+        try:
+            date = parse_datetime(expense_data.get('date'), 'date')
+            amount = to_cents(expense_data.get('amount'))
+            category_id = parse_category_id(expense_data.get('category_id'))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Get the expense before the update, locked until the commit, to move it out of its old monthly total
+        old_expense = Expense.query.filter_by(id=expense_id, user_id=user_id).with_for_update().first()
+
+        if old_expense is None:
+            return jsonify({'message': "No Expense Found"}), 404
+
+        old_snapshot = snapshot(old_expense)
+        new_values = {
+            'title': title,
+            'date': date,
+            'amount': amount,
+            'category_id': category_id,
+            'description': description
+        }
 
         # Update the expense
-        updated_expense = Expense.query.filter_by(id=expense_id, user_id=user_id).update(
-            {
-                'title': title,
-                'date': date,
-                'amount': amount,
-                'category_id': category_id,
-                'description': description
-            }
-        )
+        Expense.query.filter_by(id=expense_id, user_id=user_id).update(new_values)
+
+        # Move the expense between the monthly totals, also when its category or month changed, and evaluate the
+        # budget alerts of both categories
+        budget_statuses = sync_expense_changes(removed=[old_snapshot], added=[old_snapshot._replace(**new_values)])
+
+        response = {'message': "Expense updated successfully."}
+
+        # With check_budget, also return the category budget status
+        if expense_data.get('check_budget'):
+            response['budget_status'] = get_budget_status(budget_statuses, user_id, category_id)
 
         # Commit the changes to the database
         db.session.commit()
 
-        if updated_expense:
-            return jsonify({'message': "Expense updated successfully."}), 200
-        else:
-            return jsonify({'message': "No Expense Found"}), 404
+        return jsonify(response), 200
 
     except Exception as e:
         db.session.rollback()
@@ -214,16 +530,24 @@ def delete_expense(expense_id):
         # Get the current user id
         user_id = get_jwt_identity()
 
+        # Get the expense before deleting it, locked until the commit, to remove it from its monthly total
+        old_expense = Expense.query.filter_by(id=expense_id, user_id=user_id).with_for_update().first()
+
+        if old_expense is None:
+            return jsonify({'message': 'Expense Not Found'}), 404
+
+        old_snapshot = snapshot(old_expense)
+
+        # Remove the expense from the monthly totals and search index, before the rows referencing it go away
+        sync_expense_changes(removed=[old_snapshot])
+
         # Delete the expense directly using a query
-        deleted_expense = Expense.query.filter_by(id=expense_id, user_id=user_id).delete()
+        Expense.query.filter_by(id=expense_id, user_id=user_id).delete()
 
         # Commit the changes to the database
         db.session.commit()
 
-        if deleted_expense:
-            return jsonify({'message': 'Expense deleted successfully.'}), 200
-        else:
-            return jsonify({'message': 'Expense Not Found'}), 404
+        return jsonify({'message': 'Expense deleted successfully.'}), 200
 
     except Exception as e:
         db.session.rollback()
@@ -232,6 +556,74 @@ def delete_expense(expense_id):
         return jsonify({'message': 'An error occurred while deleting expense.'}), 500
 
 
+# To update many expenses with one statement, e.g. to recategorize them
+# JSON body:
+#   ids      - list of expense ids, and/or
+#   filters  - the same filters as GET /expense, e.g. {"category_id": [1, 2], "start_date": "2024-01-01"}
+#   changes  - the new values, any of title, description, date, amount, category_id
+@expense.route('/bulk-update-expenses', methods=['PUT'])
+@jwt_required()
+def bulk_update():
+    try:
+
+        # Get the current user id
+        user_id = get_jwt_identity()
+
+        # Read the selected expenses and the new values from the request
+        try:
+            ids, filters = parse_bulk_selection(request.json)
+            changes = parse_bulk_changes(request.json)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Update them, the monthly totals, search index and budget flags in one transaction
+        updated = bulk_update_expenses(user_id, ids, filters, changes)
+
+        # Commit the changes to the database
+        db.session.commit()
+
+        return jsonify({'message': f'{updated} expenses updated successfully.', 'affected': updated}), 200
+
+    except Exception as e:
+        db.session.rollback()
+
+        logger.error(e)
+        return jsonify({'message': 'An error occurred while updating expenses.'}), 500
+
+
+# To delete many expenses with one statement
+# JSON body:
+#   ids      - list of expense ids, and/or
+#   filters  - the same filters as GET /expense
+@expense.route('/bulk-delete-expenses', methods=['DELETE'])
+@jwt_required()
+def bulk_delete():
+    try:
+
+        # Get the current user id
+        user_id = get_jwt_identity()
+
+        # Read the selected expenses from the request
+        try:
+            ids, filters = parse_bulk_selection(request.json)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Delete them, and update the monthly totals, search index and budget flags in one transaction
+        deleted = bulk_delete_expenses(user_id, ids, filters)
+
+        # Commit the changes to the database
+        db.session.commit()
+
+        return jsonify({'message': f'{deleted} expenses deleted successfully.', 'affected': deleted}), 200
+
+    except Exception as e:
+        db.session.rollback()
+
+        logger.error(e)
+        return jsonify({'message': 'An error occurred while deleting expenses.'}), 500
+
+
 # To check the current month expense will exceed the budget or not
 @expense.route('/check-monthly-expense', methods=['POST'])
 @jwt_required()
@@ -243,52 +635,12 @@ def check_monthly_expense_with_budget():
         # Get expense data to be store from request
         category_id = request.json.get('category_id')
 
-        # Get the current year and month
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-
-        # Query expenses for the given user, category, and current year/month
-        total_expense = db.session.query(db.func.sum(Expense.amount)).filter(
-            Expense.user_id == user_id,
-            Expense.category_id == category_id,
-            extract('year', Expense.date) == current_year,
-            extract('month', Expense.date) == current_month
-        ).scalar() or 0
-
-        # Query the budget for the given user and category
-        budget = Budget.query.filter_by(user_id=user_id, category_id=category_id).first()
-
-        if budget:
-            is_exceed_value = budget.is_exceed
-
-            # Compare total expense with the budget amount
-            if total_expense >= budget.amount:
-                # Update is_exceed field of the budget to True
-                budget.is_exceed = True
-            else:
-                # Reset is_exceed field of the budget to False
-                budget.is_exceed = False
-
-            db.session.commit()
-
-            # Create a notification if expenses reach or exceed the budget
-            if is_exceed_value is False and total_expense >= budget.amount:
-                if total_expense == budget.amount:
-                    title = 'Budget Reached'
-                    message = f'Your expenses in category {budget.category.name} have reached the budget limit.'
-                else:
-                    title = 'Budget Exceeded'
-                    message = f'Your expenses in category {budget.category.name} have exceeded the budget.'
-
-                notification = Notification(
-                    title=title,
-                    message=message,
-                    user_id=user_id
-                )
-                db.session.add(notification)
-                db.session.commit()
-
-        return jsonify({'message': 'Monthly expenses have been checked against the budget.'}), 200
+        # Compare the current month expense with the budget, and commit the budget and notification together
+        budget_status = evaluate_expense_budget(user_id, category_id)
+        db.session.commit()
+
+        return jsonify({'message': 'Monthly expenses have been checked against the budget.',
+                        'budget_status': budget_status}), 200
 
     except Exception as e:
         # Rollback changes if an error occurs
@@ -316,16 +668,86 @@ def predict_expense_category():
         # Preprocess combined text
         preprocessed_combined_text = preprocess_text(combined_text)
 
-        # Vectorize combined text
-        combined_text_vectorized = vectorizer.transform([preprocessed_combined_text])
+        # Get the model, loaded on first use, a new version also invalidates the cached predictions
+        categorizer = categorizer_registry.get()
+
+        # Return the cached prediction of the same preprocessed text if there is one
+        prediction = prediction_cache.get(preprocessed_combined_text, categorizer.version)
 
-        # Make predictions
-        predictions = nb_model.predict(combined_text_vectorized)
+        if prediction is None and CATEGORIZER_BATCH_WINDOW_MS > 0:
+            # Predict together with the other requests arriving within the batch window
+            prediction = categorizer_batcher.predict(preprocessed_combined_text)
 
-        # Get the prediction (it is in array/list form)
-        prediction = predictions[0]
+            prediction_cache.set(preprocessed_combined_text, prediction, categorizer.version)
+
+        elif prediction is None:
+            # Vectorize combined text
+            combined_text_vectorized = categorizer.vectorizer.transform([preprocessed_combined_text])
+
+            # Make predictions
+            predictions = categorizer.nb_model.predict(combined_text_vectorized)
+
+            # Get the prediction (it is in array/list form)
+            prediction = predictions[0]
+
+            prediction_cache.set(preprocessed_combined_text, prediction, categorizer.version)
 
         return jsonify({'prediction': prediction})
     except Exception as e:
         logger.error(e)
         return jsonify({'message': 'An error occurred while predicting the expense category.'}), 500
+
+
+# To predict and suggest the categories of many expenses in one call
+# Request body: {"items": [{"title": ..., "description": ...}, ...], "top_k": optional number of suggestions}
+@expense.route('/predict-expense-category-batch', methods=['POST'])
+@jwt_required()
+def predict_expense_category_batch():
+    try:
+        # Get the items and the number of suggestions from the request
+        items = request.json.get('items')
+        top_k = request.json.get('top_k')
+
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return jsonify({'message': 'items must be a list of objects with title and description.'}), 400
+        if len(items) > MAX_PREDICT_BATCH_SIZE:
+            return jsonify({'message': f'At most {MAX_PREDICT_BATCH_SIZE} items can be predicted at once.'}), 400
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            return jsonify({'message': 'top_k must be a positive integer.'}), 400
+
+        if not items:
+            return jsonify({'predictions': []}), 200
+
+        # Concatenate title and description the same way as the single prediction
+        combined_texts = [f"{item.get('title')} {item.get('description')}" for item in items]
+
+        # Vectorize all the texts with one transform call, then make all the predictions with one predict call
+        categorizer = categorizer_registry.get()
+        texts_vectorized = vectorize_texts(categorizer, combined_texts)
+        predictions = categorizer.nb_model.predict(texts_vectorized)
+
+        if top_k:
+            suggestions = top_categories(categorizer.nb_model, texts_vectorized, top_k)
+            results = [{'prediction': prediction, 'suggestions': suggestion}
+                       for prediction, suggestion in zip(predictions, suggestions)]
+        else:
+            results = [{'prediction': prediction} for prediction in predictions]
+
+        return jsonify({'predictions': results}), 200
+    except Exception as e:
+        logger.error(e)
+        return jsonify({'message': 'An error occurred while predicting the expense categories.'}), 500
+
+
+# To get the metrics of the prediction cache and the micro-batching inference queue
+@expense.route('/categorizer-metrics')
+@jwt_required()
+def get_categorizer_metrics():
+    try:
+        return jsonify({
+            'cache': prediction_cache.stats(),
+            'batching': dict(categorizer_batcher.metrics(), enabled=CATEGORIZER_BATCH_WINDOW_MS > 0)
+        }), 200
+    except Exception as e:
+        logger.error(e)
+        return jsonify({'message': str(e)}), 500
@@ -0,0 +1,198 @@
+from decimal import Decimal
+from sqlalchemy import func, desc, or_, and_
+from .models import Expense, Category, MonthlyExpenseTotal
+from .time_window import current_year_month, next_year_month, month_window
+from . import db
+
+# Supported sizes of the periods in the spending series
+GRANULARITIES = ('month', 'year')
+
+# Default and maximum number of titles in the top titles list
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 50
+
+# Default and maximum number of months covered by one analytics request
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 120
+
+# Range of the years accepted in from and to, the month after the last one must still be a date
+MIN_YEAR = 1900
+MAX_YEAR = 9998
+
+
+# To parse a YYYY-MM string into (year, month)
+def parse_year_month(value, name):
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        raise ValueError(f'Invalid {name}, expected YYYY-MM.')
+
+    if not MIN_YEAR <= year <= MAX_YEAR or not 1 <= month <= 12:
+        raise ValueError(f'Invalid {name}, expected YYYY-MM.')
+
+    return year, month
+
+
+# To count the months of the inclusive range [start, end]
+def months_between(start, end):
+    return (end[0] - start[0]) * 12 + end[1] - start[1] + 1
+
+
+# To read the analytics options (month range, granularity, top_n, categories) from the request arguments
+# The range is inclusive and in local months, by default the last 12 months up to the current one
+def parse_analytics_options(args, category_ids=None):
+    end = parse_year_month(args.get('to'), 'to') if args.get('to') else current_year_month()
+
+    if args.get('from'):
+        start = parse_year_month(args.get('from'), 'from')
+    else:
+        start = (end[0] - 1, end[1] + 1) if end[1] < 12 else (end[0], 1)
+
+    months = months_between(start, end)
+    if months < 1:
+        raise ValueError('Invalid range, from must not be after to.')
+    if months > MAX_MONTHS:
+        raise ValueError(f'Invalid range, at most {MAX_MONTHS} months are allowed.')
+
+    granularity = args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Invalid granularity, expected one of {', '.join(GRANULARITIES)}.")
+
+    try:
+        top_n = int(args.get('top_n', DEFAULT_TOP_N))
+    except ValueError:
+        raise ValueError('Invalid top_n, expected an integer.')
+    if top_n < 0:
+        raise ValueError('Invalid top_n, expected a non-negative integer.')
+
+    return {
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'top_n': min(top_n, MAX_TOP_N),
+        'category_ids': category_ids,
+    }
+
+
+# To filter a query over the monthly totals to one user, the month range and optionally some categories
+def _filter_rollup(query, user_id, options):
+    (start_year, start_month), (end_year, end_month) = options['start'], options['end']
+
+    query = query.filter(
+        MonthlyExpenseTotal.user_id == user_id,
+        or_(MonthlyExpenseTotal.year > start_year,
+            and_(MonthlyExpenseTotal.year == start_year, MonthlyExpenseTotal.month >= start_month)),
+        or_(MonthlyExpenseTotal.year < end_year,
+            and_(MonthlyExpenseTotal.year == end_year, MonthlyExpenseTotal.month <= end_month))
+    )
+    if options['category_ids']:
+        query = query.filter(MonthlyExpenseTotal.category_id.in_(options['category_ids']))
+
+    return query
+
+
+# To list every period key of the range, so periods without expenses are returned as zero
+def _period_keys(options):
+    keys = []
+    year_month = options['start']
+    for _ in range(months_between(options['start'], options['end'])):
+        key = year_month if options['granularity'] == 'month' else (year_month[0],)
+        if not keys or keys[-1] != key:
+            keys.append(key)
+        year_month = next_year_month(*year_month)
+
+    return keys
+
+
+# To format a period key as YYYY-MM or YYYY
+def _period_label(key):
+    return f'{key[0]:04d}-{key[1]:02d}' if len(key) == 2 else f'{key[0]:04d}'
+
+
+# To get the total and count per period, with the change from the previous period
+def totals_by_period(user_id, options):
+    columns = [MonthlyExpenseTotal.year]
+    if options['granularity'] == 'month':
+        columns.append(MonthlyExpenseTotal.month)
+
+    query = db.session.query(*columns, func.sum(MonthlyExpenseTotal.total), func.sum(MonthlyExpenseTotal.count))
+    query = _filter_rollup(query, user_id, options).group_by(*columns)
+
+    totals = {tuple(row[:-2]): (row[-2], int(row[-1])) for row in query}
+
+    periods = []
+    previous_total = None
+    for key in _period_keys(options):
+        total, count = totals.get(key, (Decimal('0.00'), 0))
+
+        # Change from the previous period, the percent is None when the previous period had no spending
+        if previous_total is None:
+            change, change_percent = None, None
+        else:
+            change = total - previous_total
+            change_percent = round(float(change / previous_total * 100), 2) if previous_total else None
+
+        periods.append({
+            'period': _period_label(key),
+            'total': total,
+            'count': count,
+            'change': change,
+            'change_percent': change_percent,
+        })
+        previous_total = total
+
+    return periods
+
+
+# To get the total and count per category over the range, highest total first
+def totals_by_category(user_id, options):
+    query = db.session.query(
+        Category.id, Category.name,
+        func.sum(MonthlyExpenseTotal.total).label('total'), func.sum(MonthlyExpenseTotal.count)
+    ).join(Category, MonthlyExpenseTotal.category_id == Category.id)
+    query = _filter_rollup(query, user_id, options) \
+        .group_by(Category.id, Category.name) \
+        .order_by(desc('total'), Category.id)
+
+    return [{
+        'category_id': category_id,
+        'category_name': name,
+        'total': total,
+        'count': int(count),
+    } for category_id, name, total, count in query]
+
+
+# To get the titles with the highest total over the range, grouped in SQL and limited to top_n rows
+def top_titles(user_id, options):
+    if options['top_n'] == 0:
+        return []
+
+    # The local month range as a [start, end) date range, an index range scan on (user_id, date)
+    start, _ = month_window(*options['start'])
+    _, end = month_window(*options['end'])
+
+    query = db.session.query(
+        Expense.title, func.sum(Expense.amount).label('total'), func.count()
+    ).filter(Expense.user_id == user_id, Expense.date >= start, Expense.date < end)
+    if options['category_ids']:
+        query = query.filter(Expense.category_id.in_(options['category_ids']))
+    query = query.group_by(Expense.title).order_by(desc('total'), Expense.title).limit(options['top_n'])
+
+    return [{'title': title, 'total': total, 'count': int(count)} for title, total, count in query]
+
+
+# To compute the spending analytics of a user, a few grouped queries whose result size does not depend on the
+# number of expenses
+def expense_analytics(user_id, options):
+    by_period = totals_by_period(user_id, options)
+
+    return {
+        'from': _period_label(options['start']),
+        'to': _period_label(options['end']),
+        'granularity': options['granularity'],
+        'total': sum((period['total'] for period in by_period), Decimal('0.00')),
+        'count': sum(period['count'] for period in by_period),
+        'by_period': by_period,
+        'by_category': totals_by_category(user_id, options),
+        'top_titles': top_titles(user_id, options),
+    }
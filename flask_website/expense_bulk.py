@@ -0,0 +1,126 @@
+from werkzeug.datastructures import MultiDict
+from .models import Expense, Category
+from .expense_filters import parse_expense_filters, apply_expense_filters, parse_datetime, to_cents, \
+    parse_category_id
+from .expense_sync import snapshot, sync_expense_changes
+from . import db
+
+# Maximum number of ids accepted by one bulk request
+MAX_BULK_IDS = 1000
+
+# Columns a bulk update can change
+BULK_UPDATE_COLUMNS = ('title', 'description', 'date', 'amount', 'category_id')
+
+
+# To read which expenses a bulk request applies to, a list of ids and/or the same filters as GET /expense
+# Returns (ids or None, filters). One of them is required so an empty body never changes every expense
+def parse_bulk_selection(data):
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(expense_id, int) for expense_id in ids):
+            raise ValueError('Invalid ids, expected a list of integers.')
+        if not ids:
+            raise ValueError('Invalid ids, expected at least one id.')
+        if len(ids) > MAX_BULK_IDS:
+            raise ValueError(f'Too many ids, at most {MAX_BULK_IDS} are allowed.')
+
+    # The filters use the query string names, e.g. {"category_id": [1, 2], "start_date": "2024-01-01"}
+    raw_filters = data.get('filters') or {}
+    if not isinstance(raw_filters, dict):
+        raise ValueError('Invalid filters, expected an object.')
+    filters = parse_expense_filters(MultiDict([
+        (key, str(item)) for key, value in raw_filters.items()
+        for item in (value if isinstance(value, list) else [value])
+    ]))
+
+    if ids is None and not filters:
+        raise ValueError('Specify the ids or at least one filter of the expenses.')
+
+    return ids, filters
+
+
+# To read and convert the new column values of a bulk update
+def parse_bulk_changes(data):
+    changes = data.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError('Invalid changes, expected an object with the columns to update.')
+
+    unknown = sorted(set(changes) - set(BULK_UPDATE_COLUMNS))
+    if unknown:
+        raise ValueError(f"Unknown columns {', '.join(unknown)}, expected {', '.join(BULK_UPDATE_COLUMNS)}.")
+
+    # Converted like a single update, the date is stored in UTC and the amount in cents, the texts are checked
+    # like the imported ones
+    values = dict(changes)
+    if 'title' in values:
+        title = str(values['title']).strip() if values['title'] is not None else ''
+        if not title:
+            raise ValueError('title is required.')
+        if len(title) > 50:
+            raise ValueError('title must be at most 50 characters.')
+        values['title'] = title
+    if 'description' in values and values['description'] is not None:
+        values['description'] = str(values['description']).strip() or None
+        if values['description'] is not None and len(values['description']) > 255:
+            raise ValueError('description must be at most 255 characters.')
+    if 'date' in values:
+        values['date'] = parse_datetime(values['date'], 'date')
+    if 'amount' in values:
+        values['amount'] = to_cents(values['amount'])
+    if 'category_id' in values:
+        values['category_id'] = parse_category_id(values['category_id'])
+        if db.session.get(Category, values['category_id']) is None:
+            raise ValueError(f"Unknown category_id {values['category_id']}.")
+
+    return values
+
+
+# To build the query of the user's selected expenses
+def _selected_expenses(user_id, ids, filters):
+    query = apply_expense_filters(Expense.query.filter(Expense.user_id == user_id), filters)
+    if ids is not None:
+        query = query.filter(Expense.id.in_(ids))
+    return query
+
+
+# To lock the selected expenses until the commit and take their snapshots, in one query
+def _lock_snapshots(query):
+    rows = query.with_entities(Expense.id, Expense.user_id, Expense.category_id, Expense.date, Expense.amount,
+                               Expense.title, Expense.description).with_for_update().all()
+    return [snapshot(row) for row in rows]
+
+
+# To update the selected expenses of a user with one UPDATE statement, without committing, keeping the monthly
+# totals, search index and budget alerts in step. Returns the number of updated expenses
+def bulk_update_expenses(user_id, ids, filters, changes):
+    query = _selected_expenses(user_id, ids, filters)
+
+    old_snapshots = _lock_snapshots(query)
+    if not old_snapshots:
+        return 0
+
+    new_snapshots = [expense._replace(**changes) for expense in old_snapshots]
+
+    # The locked rows are the ones matching the selection, so the statement updates exactly them
+    updated = query.update(changes, synchronize_session=False)
+
+    sync_expense_changes(removed=old_snapshots, added=new_snapshots)
+
+    return updated
+
+
+# To delete the selected expenses of a user with one DELETE statement, without committing, keeping the monthly
+# totals, search index and budget alerts in step. Returns the number of deleted expenses
+def bulk_delete_expenses(user_id, ids, filters):
+    query = _selected_expenses(user_id, ids, filters)
+
+    old_snapshots = _lock_snapshots(query)
+    if not old_snapshots:
+        return 0
+
+    # Remove them from the derived data first, before the rows referencing them go away
+    sync_expense_changes(removed=old_snapshots)
+
+    deleted = query.delete(synchronize_session=False)
+
+    return deleted
@@ -0,0 +1,104 @@
+from sqlalchemy import select
+from .models import Expense, Category
+from .expense_filters import apply_expense_filters
+from . import db
+import csv
+import io
+import json
+import logging
+import zlib
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# Supported export formats with their content types
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows fetched per round trip from the server-side cursor, and rows written per chunk of the response
+EXPORT_BATCH_SIZE = 1000
+
+# Columns of the export, the same names the import accepts so an export can be imported again
+EXPORT_COLUMNS = ['id', 'title', 'date', 'amount', 'category_id', 'category', 'description']
+
+
+# To stream the user's expenses matching the filters, oldest first, with a server-side cursor so only one
+# batch of rows is held in memory at a time
+def iter_expense_rows(user_id, filters):
+    statement = select(
+        Expense.id, Expense.title, Expense.date, Expense.amount, Expense.category_id,
+        Category.name.label('category'), Expense.description
+    ).join(Category, Expense.category_id == Category.id).where(Expense.user_id == user_id)
+
+    statement = apply_expense_filters(statement, filters).order_by(Expense.date, Expense.id)
+
+    for row in db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+        yield {
+            'id': row.id,
+            'title': row.title,
+            'date': row.date.isoformat(),
+            'amount': str(row.amount),
+            'category_id': row.category_id,
+            'category': row.category,
+            'description': row.description,
+        }
+
+
+# To encode the rows as CSV text chunks, the header first
+def iter_csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+# To encode the rows as NDJSON text chunks, one JSON object per line
+def iter_ndjson_chunks(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+# To gzip a stream of byte chunks incrementally, wbits=31 writes the gzip header and trailer
+def iter_gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+# To stream the export of the user's expenses as bytes in the given format, optionally gzip-compressed
+def iter_export(user_id, filters, export_format, compress=False):
+    rows = iter_expense_rows(user_id, filters)
+    text_chunks = iter_csv_chunks(rows) if export_format == 'csv' else iter_ndjson_chunks(rows)
+    chunks = (chunk.encode() for chunk in text_chunks if chunk)
+
+    if compress:
+        chunks = iter_gzip_chunks(chunks)
+
+    try:
+        yield from chunks
+    except Exception as e:
+        # The status and headers are already sent, so the error can only be logged and the response cut short
+        logger.error(e)
+        db.session.rollback()
@@ -0,0 +1,140 @@
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from sqlalchemy import and_, or_
+from .models import Expense
+import base64
+
+# Default and maximum number of expenses returned in one page
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# To parse an ISO 8601 date string into a naive UTC datetime (the format stored in database)
+def parse_datetime(value, name):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {name}, expected an ISO 8601 date.')
+
+    # Convert the aware datetime to UTC, then drop the timezone to compare with the stored dates
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
+
+# To parse a decimal amount from the query string, NaN and Infinity are not numbers here
+def parse_amount(value, name):
+    try:
+        amount = Decimal(value)
+    except (TypeError, InvalidOperation):
+        raise ValueError(f'Invalid {name}, expected a number.')
+    if not amount.is_finite():
+        raise ValueError(f'Invalid {name}, expected a number.')
+    return amount
+
+
+# To round an amount to cents the same way the Numeric(10, 2) column stores it
+def to_cents(value):
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise ValueError('Invalid amount.')
+        return amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError('Invalid amount.')
+
+
+# To parse the category_id of an expense from the JSON body, an integer or a string of one
+def parse_category_id(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('Invalid category_id, expected an integer.')
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('Invalid category_id, expected an integer.')
+
+
+# To read the expense filters (date range, categories and amount range) from the request arguments
+def parse_expense_filters(args):
+    filters = {}
+
+    # The date range is half-open, start_date <= date < end_date
+    if args.get('start_date'):
+        filters['start_date'] = parse_datetime(args.get('start_date'), 'start_date')
+    if args.get('end_date'):
+        filters['end_date'] = parse_datetime(args.get('end_date'), 'end_date')
+
+    # Allow both ?category_id=1&category_id=2 and ?category_id=1,2
+    category_ids = []
+    for value in args.getlist('category_id'):
+        for part in value.split(','):
+            if part.strip():
+                try:
+                    category_ids.append(int(part))
+                except ValueError:
+                    raise ValueError('Invalid category_id, expected an integer.')
+    if category_ids:
+        filters['category_ids'] = category_ids
+
+    # The amount range is inclusive on both ends
+    if args.get('min_amount'):
+        filters['min_amount'] = parse_amount(args.get('min_amount'), 'min_amount')
+    if args.get('max_amount'):
+        filters['max_amount'] = parse_amount(args.get('max_amount'), 'max_amount')
+
+    return filters
+
+
+# To apply the parsed filters to a query over the Expense table
+def apply_expense_filters(query, filters):
+    if 'start_date' in filters:
+        query = query.filter(Expense.date >= filters['start_date'])
+    if 'end_date' in filters:
+        query = query.filter(Expense.date < filters['end_date'])
+    if 'category_ids' in filters:
+        query = query.filter(Expense.category_id.in_(filters['category_ids']))
+    if 'min_amount' in filters:
+        query = query.filter(Expense.amount >= filters['min_amount'])
+    if 'max_amount' in filters:
+        query = query.filter(Expense.amount <= filters['max_amount'])
+
+    return query
+
+
+# To read the page size from the request arguments
+def parse_page_size(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Invalid limit, expected an integer.')
+
+    if limit < 1:
+        raise ValueError('Invalid limit, expected a positive integer.')
+
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# To encode the (date, id) of the last expense in a page as an opaque cursor
+def encode_cursor(date, expense_id):
+    raw = f'{date.isoformat()}|{expense_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+# To decode the cursor back into (date, id)
+def decode_cursor(cursor):
+    try:
+        date_text, id_text = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(date_text), int(id_text)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor.')
+
+
+# To continue a (date DESC, id DESC) ordered query after the cursor position
+def apply_cursor(query, cursor):
+    date, expense_id = decode_cursor(cursor)
+
+    return query.filter(or_(
+        Expense.date < date,
+        and_(Expense.date == date, Expense.id < expense_id)
+    ))
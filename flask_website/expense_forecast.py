@@ -0,0 +1,170 @@
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import and_, or_, func, insert
+from .models import Budget, MonthlyExpenseTotal, ExpenseForecastState
+from .expense_rollup import expense_deltas, get_monthly_total
+from . import db
+
+# The period (year * 100 + month) of a monthly total, comparable with ExpenseForecastState.through_period
+MONTH_PERIOD = MonthlyExpenseTotal.year * 100 + MonthlyExpenseTotal.month
+
+
+# To compute the least squares sums (n, sum_x, sum_x2, sum_y, sum_xy) of a series of monthly totals in month
+# order, x being the index of the month in the series
+def series_sums(totals):
+    n, sum_x, sum_x2, sum_y, sum_xy = 0, 0, 0, Decimal(0), Decimal(0)
+    for x, total in enumerate(totals):
+        n += 1
+        sum_x += x
+        sum_x2 += x * x
+        sum_y += total
+        sum_xy += x * total
+    return n, sum_x, sum_x2, sum_y, sum_xy
+
+
+# To predict the value following a series from its least squares sums, the same line as LinearRegression
+# fitted on the month indexes. A series of one month has a flat line through its only value
+def forecast_next_value(n, sum_x, sum_x2, sum_y, sum_xy):
+    denominator = n * sum_x2 - sum_x * sum_x
+    slope = (n * sum_xy - sum_x * sum_y) / denominator if denominator else Decimal(0)
+    intercept = (sum_y - slope * sum_x) / n
+    return intercept + slope * n
+
+
+# Every change of the monthly totals of a user's category with a state locks the state first, and the
+# prediction job locks the states before reading the totals, so both take the state then the totals and the
+# state lock serialises them. The expense path still reads the totals of its category with a locking read, its
+# transaction may have a snapshot taken before it got the state lock
+
+
+# To compute the sums of a state again from its monthly totals up to its through_period
+def _recompute_state(state):
+    totals = [total for total, in db.session.query(MonthlyExpenseTotal.total).filter(
+        MonthlyExpenseTotal.user_id == state.user_id,
+        MonthlyExpenseTotal.category_id == state.category_id,
+        MONTH_PERIOD <= state.through_period
+    ).order_by(MonthlyExpenseTotal.year, MonthlyExpenseTotal.month).with_for_update(read=True)]
+
+    state.n, state.sum_x, state.sum_x2, state.sum_y, state.sum_xy = series_sums(totals)
+
+
+# To get whether a month of a user's category gained its first expense or lost its last one with a change of
+# count expenses, reading the updated monthly total
+def _month_set_changed(user_id, category_id, year, month, count):
+    _, new_count = get_monthly_total(user_id, category_id, year, month)
+    return (new_count > 0) != (new_count - count > 0)
+
+
+# To lock the forecast states of the categories changed by the removed and added expenses until the commit, in
+# (user_id, category_id) order. Call it before the rollup is updated, so the expense changes and the prediction
+# job lock the states before the totals. Returns the existing states by (user_id, category_id)
+def lock_forecast_states(removed, added):
+    states = {}
+    for user_id, category_id in sorted({(expense.user_id, expense.category_id) for expense in removed + added}):
+        state = db.session.query(ExpenseForecastState).filter_by(
+            user_id=user_id, category_id=category_id
+        ).with_for_update().populate_existing().first()
+
+        if state is not None:
+            states[(user_id, category_id)] = state
+    return states
+
+
+# To update the forecast sums with the removed and added expenses, without committing, so it is part of the
+# caller's transaction. Call it after the rollup is updated, with the states from lock_forecast_states. Both
+# are lists of ExpenseSnapshot
+# Only the months already in the sums are applied, the later ones are folded in when the prediction job runs
+def apply_forecast_changes(removed, added, states):
+    changes = defaultdict(list)
+    for (user_id, category_id, year, month), (amount, count) in expense_deltas(removed, added).items():
+        if amount != 0 or count != 0:
+            changes[(user_id, category_id)].append((year, month, amount, count))
+
+    for (user_id, category_id), months in sorted(changes.items()):
+        state = states.get((user_id, category_id))
+        if state is None:
+            continue
+        months = [change for change in months if change[0] * 100 + change[1] <= state.through_period]
+
+        # A month appearing or disappearing moves the index of the later months, so the sums are computed again
+        # from the updated monthly totals, with all the changes of the category
+        if any(_month_set_changed(user_id, category_id, year, month, count) for year, month, _, count in months):
+            _recompute_state(state)
+            continue
+
+        # Otherwise only the totals of the months change, each at its index among the earlier months
+        for year, month, amount, _ in months:
+            index = db.session.query(func.count()).select_from(MonthlyExpenseTotal).filter(
+                MonthlyExpenseTotal.user_id == user_id,
+                MonthlyExpenseTotal.category_id == category_id,
+                or_(MonthlyExpenseTotal.year < year,
+                    and_(MonthlyExpenseTotal.year == year, MonthlyExpenseTotal.month < month))
+            ).with_for_update(read=True).scalar()
+
+            state.sum_y += amount
+            state.sum_xy += index * amount
+
+
+# To create empty states, through no month yet, for the budgets of the users in (low_user_id, high_user_id]
+# without one, e.g. created since the last run, without committing. advance_forecast_states folds in their
+# months like the other states. A user's category has at most one state even if it had several budgets
+def create_forecast_states(low_user_id, high_user_id):
+    missing = db.session.query(Budget.user_id, Budget.category_id).outerjoin(ExpenseForecastState, and_(
+        ExpenseForecastState.user_id == Budget.user_id,
+        ExpenseForecastState.category_id == Budget.category_id
+    )).filter(
+        Budget.user_id > low_user_id,
+        Budget.user_id <= high_user_id,
+        ExpenseForecastState.user_id.is_(None)
+    ).distinct().order_by(Budget.user_id, Budget.category_id).all()
+
+    if missing:
+        db.session.execute(insert(ExpenseForecastState), [{
+            'user_id': user_id, 'category_id': category_id, 'through_period': 0,
+            'n': 0, 'sum_x': 0, 'sum_x2': 0, 'sum_y': 0, 'sum_xy': 0
+        } for user_id, category_id in missing])
+
+
+# To bring the forecast sums of the users in (low_user_id, high_user_id] up to through_period, without
+# committing, by folding in the months after their own through_period
+# Call it at the start of a transaction: the states are locked first, so the expense changes holding one are
+# committed before the totals are read, and the later ones wait for the commit. The totals are then read with
+# a plain read, whose snapshot is taken after the locks, and only the rows of the months not folded in yet
+def advance_forecast_states(low_user_id, high_user_id, through_period):
+    states = {(state.user_id, state.category_id): state for state in ExpenseForecastState.query.filter(
+        ExpenseForecastState.user_id > low_user_id,
+        ExpenseForecastState.user_id <= high_user_id,
+        ExpenseForecastState.through_period < through_period
+    ).with_for_update()}
+
+    if not states:
+        return
+
+    # The year bound keeps the reads of each category to its recent months on the primary key
+    first_year = min(state.through_period for state in states.values()) // 100
+
+    new_months = db.session.query(
+        MonthlyExpenseTotal.user_id, MonthlyExpenseTotal.category_id, MonthlyExpenseTotal.total
+    ).join(ExpenseForecastState, and_(
+        ExpenseForecastState.user_id == MonthlyExpenseTotal.user_id,
+        ExpenseForecastState.category_id == MonthlyExpenseTotal.category_id
+    )).filter(
+        MonthlyExpenseTotal.user_id > low_user_id,
+        MonthlyExpenseTotal.user_id <= high_user_id,
+        MonthlyExpenseTotal.year >= first_year,
+        MONTH_PERIOD > ExpenseForecastState.through_period,
+        MONTH_PERIOD <= through_period
+    ).order_by(MonthlyExpenseTotal.user_id, MonthlyExpenseTotal.category_id, MonthlyExpenseTotal.year,
+               MonthlyExpenseTotal.month)
+
+    for user_id, category_id, total in new_months:
+        state = states[(user_id, category_id)]
+        x = state.n
+        state.n += 1
+        state.sum_x += x
+        state.sum_x2 += x * x
+        state.sum_y += total
+        state.sum_xy += x * total
+
+    for state in states.values():
+        state.through_period = through_period
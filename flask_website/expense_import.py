@@ -0,0 +1,261 @@
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert, select, func
+from .models import Expense, Category
+from .expense_filters import parse_datetime, to_cents
+from .expense_sync import ExpenseSnapshot, sync_expense_changes
+from . import db
+import csv
+import io
+import json
+import logging
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# Number of rows inserted per executemany batch, each batch is committed in its own transaction
+BATCH_SIZE = 500
+
+# Stop reporting row errors after this many so the response stays small
+MAX_REPORTED_ERRORS = 1000
+
+# Largest amount accepted by the Numeric(10, 2) amount column
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+# To find the upload format from the explicit format, the file name or the content type
+def detect_format(requested_format, filename, content_type):
+    if requested_format:
+        requested_format = requested_format.lower()
+        if requested_format not in ('csv', 'ndjson'):
+            raise ValueError('Invalid format, expected csv or ndjson.')
+        return requested_format
+
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+
+    if filename.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if filename.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+
+    raise ValueError('Unable to detect the upload format, please specify format=csv or format=ndjson.')
+
+
+# Raised when the rest of an upload cannot be read, e.g. text that is not UTF-8 or a CSV with NUL bytes
+class UploadReadError(ValueError):
+    def __init__(self, row_number, message):
+        super().__init__(message)
+        self.row_number = row_number
+
+
+# To read the upload one record at a time, yielding (row number, record or None, parse error or None)
+# Raises UploadReadError with the row being read when the rest of the upload cannot be read
+def iter_records(binary_stream, upload_format):
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+
+    # Number of rows read in full, the row after them is the one being read
+    rows_read = 0
+    try:
+        if upload_format == 'csv':
+            # Read the header, row 1, so the first record is row 2 like in a spreadsheet
+            reader = csv.DictReader(text_stream)
+            if reader.fieldnames is not None:
+                rows_read = 1
+            for row_number, record in enumerate(reader, start=2):
+                rows_read = row_number
+                yield row_number, record, None
+        else:
+            for row_number, line in enumerate(text_stream, start=1):
+                rows_read = row_number
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield row_number, None, 'Invalid JSON.'
+                    continue
+                if not isinstance(record, dict):
+                    yield row_number, None, 'Expected a JSON object.'
+                    continue
+                yield row_number, record, None
+
+    except UnicodeDecodeError:
+        raise UploadReadError(rows_read + 1, 'Unable to read the file, it is not UTF-8 encoded text.')
+    except csv.Error as e:
+        raise UploadReadError(rows_read + 1, f'Unable to read the file as CSV: {e}.')
+
+
+# To get a stripped string value from a record, or None if it is missing or empty
+def _get_text(record, key):
+    value = record.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+# To validate one record and convert it into the column values of an Expense
+# Returns (values, list of errors), category_id is None when the row should be auto-categorized
+def validate_record(record, category_ids, category_names):
+    errors = []
+    values = {}
+
+    title = _get_text(record, 'title')
+    if title is None:
+        errors.append('title is required.')
+    elif len(title) > 50:
+        errors.append('title must be at most 50 characters.')
+    values['title'] = title
+
+    description = _get_text(record, 'description')
+    if description is not None and len(description) > 255:
+        errors.append('description must be at most 255 characters.')
+    values['description'] = description
+
+    date = _get_text(record, 'date')
+    if date is None:
+        errors.append('date is required.')
+    else:
+        try:
+            values['date'] = parse_datetime(date, 'date')
+        except ValueError as e:
+            errors.append(str(e))
+
+    amount = _get_text(record, 'amount')
+    if amount is None:
+        errors.append('amount is required.')
+    else:
+        try:
+            values['amount'] = Decimal(amount)
+            if not values['amount'].is_finite() or abs(values['amount']) > MAX_AMOUNT:
+                errors.append('amount is out of range.')
+            else:
+                values['amount'] = to_cents(values['amount'])
+        except InvalidOperation:
+            errors.append('Invalid amount, expected a number.')
+
+    # The category can be given by id or by name, both are checked against the Category table
+    category_id = _get_text(record, 'category_id')
+    category_name = _get_text(record, 'category') or _get_text(record, 'category_name')
+    values['category_id'] = None
+
+    if category_id is not None:
+        try:
+            values['category_id'] = int(category_id)
+        except ValueError:
+            values['category_id'] = None
+        if values['category_id'] not in category_ids:
+            errors.append(f'Unknown category_id {category_id}.')
+    elif category_name is not None:
+        values['category_id'] = category_names.get(category_name.lower())
+        if values['category_id'] is None:
+            errors.append(f'Unknown category {category_name}.')
+
+    return values, errors
+
+
+# To insert a batch of expense rows of one user with one executemany statement, returns their ids in the order
+# of the rows, needed by the search index
+def insert_expenses(rows, user_id):
+    dialect = db.session.get_bind().dialect
+
+    # RETURNING works with executemany on sqlite, postgresql and mariadb
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = db.session.execute(insert(Expense).returning(Expense.id, sort_by_parameter_order=True), rows)
+        return list(result.scalars())
+
+    # Without it (mysql) read the ids back in the same transaction: the batch gets increasing ids above the
+    # user's highest id, and under the default REPEATABLE READ isolation no other transaction's rows are seen
+    last_id = db.session.execute(select(func.coalesce(func.max(Expense.id), 0))
+                                 .where(Expense.user_id == user_id)).scalar()
+    db.session.execute(insert(Expense), rows)
+    expense_ids = list(db.session.execute(select(Expense.id).where(Expense.user_id == user_id, Expense.id > last_id)
+                                          .order_by(Expense.id)).scalars())
+
+    if len(expense_ids) != len(rows):
+        raise RuntimeError(f'Expected {len(rows)} new expense ids, found {len(expense_ids)}.')
+
+    return expense_ids
+
+
+# To import the records of an upload stream in batches
+# predict_categories, if given, takes a list of "title description" texts and returns category names
+def import_expenses(binary_stream, upload_format, user_id, predict_categories=None):
+    # Load the categories once to validate every row without extra queries
+    categories = Category.query.all()
+    category_ids = {category.id for category in categories}
+    category_names = {category.name.lower(): category.id for category in categories}
+
+    report = {'imported': 0, 'failed': 0, 'errors': [], 'stopped_at_row': None}
+
+    def add_error(row_number, messages):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': row_number, 'errors': messages})
+
+    def flush(batch):
+        # Predict the category of the rows without one, in a single call for the whole batch
+        uncategorized = [item for item in batch if item[1]['category_id'] is None]
+        if uncategorized:
+            if predict_categories is None:
+                for row_number, _ in uncategorized:
+                    add_error(row_number, ['category_id or category is required.'])
+            else:
+                texts = [f"{values['title']} {values['description']}" for _, values in uncategorized]
+                for (row_number, values), name in zip(uncategorized, predict_categories(texts)):
+                    values['category_id'] = category_names.get(str(name).lower())
+                    if values['category_id'] is None:
+                        add_error(row_number, [f'Predicted category {name} does not exist.'])
+
+        rows = [dict(values, user_id=user_id) for _, values in batch if values['category_id'] is not None]
+        if not rows:
+            return
+
+        # Insert the batch with one executemany statement, committing it as one bounded transaction
+        try:
+            expense_ids = insert_expenses(rows, user_id)
+
+            # Update the monthly totals and search index in the same transaction as the batch
+            sync_expense_changes(added=[ExpenseSnapshot(expense_id, user_id, row['category_id'], row['date'],
+                                                        row['amount'], row['title'], row['description'])
+                                        for expense_id, row in zip(expense_ids, rows)])
+            db.session.commit()
+            report['imported'] += len(rows)
+        except Exception as e:
+            # Only this batch is lost, the batches committed before it are kept
+            db.session.rollback()
+            logger.error(e)
+            for row_number, values in batch:
+                if values['category_id'] is not None:
+                    add_error(row_number, ['An error occurred while saving this row.'])
+
+    batch = []
+    try:
+        for row_number, record, parse_error in iter_records(binary_stream, upload_format):
+            if parse_error:
+                add_error(row_number, [parse_error])
+                continue
+
+            values, errors = validate_record(record, category_ids, category_names)
+            if errors:
+                add_error(row_number, errors)
+                continue
+
+            batch.append((row_number, values))
+            if len(batch) >= BATCH_SIZE:
+                flush(batch)
+                batch = []
+
+    except UploadReadError as e:
+        # The rows before the unreadable one are still imported, and reported, so a retry can start from it
+        report['stopped_at_row'] = e.row_number
+        add_error(e.row_number, [str(e), 'The import stopped at this row, the rows from it on were not imported.'])
+
+    if batch:
+        flush(batch)
+
+    # Errors found while saving a batch are added after later rows were validated, so sort them by row
+    report['errors'].sort(key=lambda error: error['row'])
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+
+    return report
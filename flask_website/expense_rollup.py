@@ -0,0 +1,149 @@
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from .models import Expense, MonthlyExpenseTotal, ExpenseForecastState
+from .time_window import local_year_month, month_window
+from . import db
+
+# Rows inserted per statement when rebuilding the rollup
+REBUILD_BATCH_SIZE = 1000
+
+
+# To get the rollup total and count of one user's category in one month, a single primary key lookup
+# populate_existing makes it read the row again after upserts made in the same session
+def get_monthly_total(user_id, category_id, year, month):
+    row = db.session.get(MonthlyExpenseTotal, (user_id, category_id, year, month), populate_existing=True)
+    if row is None:
+        return Decimal(0), 0
+    return row.total, row.count
+
+
+# To build the statement adding amount and count to a rollup row, creating it if it does not exist
+def _upsert_statement(values):
+    dialect = db.session.get_bind().dialect.name
+    total, count = MonthlyExpenseTotal.total, MonthlyExpenseTotal.count
+
+    if dialect == 'mysql':
+        statement = mysql.insert(MonthlyExpenseTotal).values(**values)
+        return statement.on_duplicate_key_update(total=total + statement.inserted.total,
+                                                 count=count + statement.inserted.count)
+
+    insert_module = postgresql if dialect == 'postgresql' else sqlite
+    statement = insert_module.insert(MonthlyExpenseTotal).values(**values)
+    return statement.on_conflict_do_update(
+        index_elements=['user_id', 'category_id', 'year', 'month'],
+        set_={'total': total + statement.excluded.total, 'count': count + statement.excluded.count}
+    )
+
+
+# To get the change of the total and count of each (user_id, category_id, year, month) with the removed and
+# added expenses. Both are lists of ExpenseSnapshot
+def expense_deltas(removed, added):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+
+    for snapshot, sign in [(snapshot, -1) for snapshot in removed] + [(snapshot, 1) for snapshot in added]:
+        key = (snapshot.user_id, snapshot.category_id) + local_year_month(snapshot.date)
+        deltas[key][0] += sign * Decimal(str(snapshot.amount))
+        deltas[key][1] += sign
+
+    return deltas
+
+
+# To apply the removed and added expenses to the rollup, without committing, so it is part of the caller's
+# transaction. Both are lists of ExpenseSnapshot
+def apply_expense_changes(removed, added):
+    for (user_id, category_id, year, month), (amount, count) in expense_deltas(removed, added).items():
+        # An update that keeps the category, month and amount changes nothing in the rollup
+        if amount == 0 and count == 0:
+            continue
+
+        db.session.execute(_upsert_statement({
+            'user_id': user_id, 'category_id': category_id, 'year': year, 'month': month,
+            'total': amount, 'count': count
+        }))
+
+        # A month without expenses has no row, like a month the prediction never saw
+        if count < 0:
+            db.session.execute(delete(MonthlyExpenseTotal).where(
+                MonthlyExpenseTotal.user_id == user_id,
+                MonthlyExpenseTotal.category_id == category_id,
+                MonthlyExpenseTotal.year == year,
+                MonthlyExpenseTotal.month == month,
+                MonthlyExpenseTotal.count <= 0
+            ))
+
+
+# To compute the rollup from the expenses, streaming the rows instead of loading them all at once
+def compute_rollup(user_id=None):
+    statement = select(Expense.user_id, Expense.category_id, Expense.date, Expense.amount)
+    if user_id is not None:
+        statement = statement.where(Expense.user_id == user_id)
+
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for row in db.session.execute(statement.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        key = (row.user_id, row.category_id) + local_year_month(row.date)
+        totals[key][0] += row.amount
+        totals[key][1] += 1
+
+    return totals
+
+
+# To compute the totals of one local month from the expenses, grouped by user and category
+# The month is filtered as a [start, end) date range, an index range scan on (user_id, date) for one user, a
+# scan of the expenses otherwise
+def compute_month_rollup(year, month, user_id=None):
+    start, end = month_window(year, month)
+
+    statement = select(Expense.user_id, Expense.category_id, func.sum(Expense.amount), func.count()) \
+        .where(Expense.date >= start, Expense.date < end) \
+        .group_by(Expense.user_id, Expense.category_id)
+    if user_id is not None:
+        statement = statement.where(Expense.user_id == user_id)
+
+    return {(row[0], row[1], year, month): [row[2], row[3]] for row in db.session.execute(statement)}
+
+
+# To replace the rollup with totals computed from the expenses, returns the number of rows written
+def rebuild_rollup(user_id=None):
+    totals = compute_rollup(user_id)
+
+    statement = delete(MonthlyExpenseTotal)
+    if user_id is not None:
+        statement = statement.where(MonthlyExpenseTotal.user_id == user_id)
+    db.session.execute(statement)
+
+    # The forecast sums come from the replaced totals, the next prediction run computes them again
+    statement = delete(ExpenseForecastState)
+    if user_id is not None:
+        statement = statement.where(ExpenseForecastState.user_id == user_id)
+    db.session.execute(statement)
+
+    rows = [{'user_id': key[0], 'category_id': key[1], 'year': key[2], 'month': key[3],
+             'total': total, 'count': count} for key, (total, count) in totals.items()]
+    for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+        db.session.execute(insert(MonthlyExpenseTotal), rows[start:start + REBUILD_BATCH_SIZE])
+
+    db.session.commit()
+
+    return len(rows)
+
+
+# To compare the rollup with totals computed from the expenses, returns the list of differences
+# With year and month, only that month is compared, using range scans instead of reading every expense
+def verify_rollup(user_id=None, year=None, month=None):
+    if year is not None and month is not None:
+        computed = compute_month_rollup(year, month, user_id)
+    else:
+        computed = compute_rollup(user_id)
+    expected = {key: tuple(value) for key, value in computed.items()}
+
+    query = MonthlyExpenseTotal.query
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    if year is not None and month is not None:
+        query = query.filter_by(year=year, month=month)
+    actual = {(row.user_id, row.category_id, row.year, row.month): (row.total, row.count) for row in query}
+
+    return [{'key': key, 'expected': expected.get(key), 'actual': actual.get(key)}
+            for key in sorted(set(expected) | set(actual)) if expected.get(key) != actual.get(key)]
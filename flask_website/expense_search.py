@@ -0,0 +1,168 @@
+from sqlalchemy import select, delete, insert, func, desc, and_, or_
+from .models import Expense, Category, ExpenseSearchToken
+from .text_normalizer import text_normalizer
+from . import db
+from datetime import datetime
+import base64
+
+# Length of the token column, longer tokens are cut to it both when indexing and when searching
+MAX_TOKEN_LENGTH = 50
+
+# Maximum number of distinct tokens in one search query
+MAX_QUERY_TOKENS = 20
+
+# Rows inserted per statement when rebuilding the index
+REBUILD_BATCH_SIZE = 1000
+
+
+# To get the distinct index tokens of a text, normalized like preprocess_text so "Grab rides" matches
+# "grab ride"
+def text_tokens(text):
+    return {token[:MAX_TOKEN_LENGTH] for token in text_normalizer.tokens(text) if token}
+
+
+# To get the distinct index tokens of an expense title and description
+def expense_tokens(title, description):
+    return text_tokens(f'{title or ""} {description or ""}')
+
+
+# To get the tokens of a search query
+def parse_search_query(query):
+    if not query or not query.strip():
+        raise ValueError('Missing q, the words to search for.')
+
+    tokens = text_tokens(query)
+    if not tokens:
+        raise ValueError('The search has no searchable words.')
+    if len(tokens) > MAX_QUERY_TOKENS:
+        raise ValueError(f'Too many words to search for, at most {MAX_QUERY_TOKENS} are allowed.')
+
+    return tokens
+
+
+# To build the index rows of an expense
+def _token_rows(expense_id, user_id, tokens):
+    return [{'expense_id': expense_id, 'user_id': user_id, 'token': token} for token in sorted(tokens)]
+
+
+# To apply the removed and added expenses to the search index, without committing, so it is part of the
+# caller's transaction. Both are lists of ExpenseSnapshot with their ids, an update is the same id in both
+def apply_search_changes(removed, added):
+    old = {expense.id: expense for expense in removed}
+    new = {expense.id: expense for expense in added}
+
+    # The deleted expenses lose all their tokens in one statement
+    deleted_ids = sorted(set(old) - set(new))
+    if deleted_ids:
+        db.session.execute(delete(ExpenseSearchToken).where(ExpenseSearchToken.expense_id.in_(deleted_ids)))
+
+    rows = []
+    for expense_id, expense in new.items():
+        previous = old.get(expense_id)
+
+        # An update that keeps the title and description changes nothing in the index
+        if previous is not None and (previous.title, previous.description) == (expense.title, expense.description):
+            continue
+
+        tokens = expense_tokens(expense.title, expense.description)
+
+        # An updated expense only loses the tokens it no longer has and gains the new ones
+        if previous is not None:
+            previous_tokens = expense_tokens(previous.title, previous.description)
+            if previous_tokens - tokens:
+                db.session.execute(delete(ExpenseSearchToken).where(
+                    ExpenseSearchToken.expense_id == expense_id,
+                    ExpenseSearchToken.token.in_(sorted(previous_tokens - tokens))
+                ))
+            tokens = tokens - previous_tokens
+
+        rows.extend(_token_rows(expense_id, expense.user_id, tokens))
+
+    if rows:
+        db.session.execute(insert(ExpenseSearchToken), rows)
+
+
+# To replace the search index with tokens computed from the expenses, returns the number of rows written
+def rebuild_search_index(user_id=None):
+    statement = delete(ExpenseSearchToken)
+    if user_id is not None:
+        statement = statement.where(ExpenseSearchToken.user_id == user_id)
+    db.session.execute(statement)
+
+    # Read the expenses in id ranges instead of all at once, inserting the tokens of each range, so no result
+    # is left open on the connection while inserting
+    written = 0
+    last_id = 0
+    while True:
+        statement = select(Expense.id, Expense.user_id, Expense.title, Expense.description) \
+            .where(Expense.id > last_id).order_by(Expense.id).limit(REBUILD_BATCH_SIZE)
+        if user_id is not None:
+            statement = statement.where(Expense.user_id == user_id)
+
+        expenses = db.session.execute(statement).all()
+        if not expenses:
+            break
+
+        rows = []
+        for expense in expenses:
+            rows.extend(_token_rows(expense.id, expense.user_id, expense_tokens(expense.title, expense.description)))
+        if rows:
+            db.session.execute(insert(ExpenseSearchToken), rows)
+            written += len(rows)
+
+        last_id = expenses[-1].id
+
+    db.session.commit()
+
+    return written
+
+
+# To encode the (rank, date, id) of the last match in a page as an opaque cursor
+def encode_search_cursor(rank, date, expense_id):
+    raw = f'{rank}|{date.isoformat()}|{expense_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+# To decode the search cursor back into (rank, date, id)
+def decode_search_cursor(cursor):
+    try:
+        rank_text, date_text, id_text = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return int(rank_text), datetime.fromisoformat(date_text), int(id_text)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor.')
+
+
+# To build the query of a user's expenses matching the tokens, with rank the number of matched tokens
+# With match_all, only the expenses having every token are returned
+def search_expenses_query(user_id, tokens, match_all=False):
+    matches = select(
+        ExpenseSearchToken.expense_id, func.count().label('rank')
+    ).where(
+        ExpenseSearchToken.user_id == user_id,
+        ExpenseSearchToken.token.in_(sorted(tokens))
+    ).group_by(ExpenseSearchToken.expense_id)
+    if match_all:
+        matches = matches.having(func.count() == len(tokens))
+    matches = matches.subquery()
+
+    return db.session.query(
+        Expense.id, Expense.title, Expense.date, Expense.amount, Expense.category_id,
+        Category.name.label('category_name'), Expense.description, matches.c.rank
+    ).join(matches, matches.c.expense_id == Expense.id) \
+        .join(Category, Expense.category_id == Category.id), matches.c.rank
+
+
+# To continue a (rank DESC, date DESC, id DESC) ordered search after the cursor position
+def apply_search_cursor(query, rank_column, cursor):
+    rank, date, expense_id = decode_search_cursor(cursor)
+
+    return query.filter(or_(
+        rank_column < rank,
+        and_(rank_column == rank, Expense.date < date),
+        and_(rank_column == rank, Expense.date == date, Expense.id < expense_id)
+    ))
+
+
+# To order the search results, best match first, then the most recent
+def order_search_results(query, rank_column):
+    return query.order_by(desc(rank_column), desc(Expense.date), desc(Expense.id))
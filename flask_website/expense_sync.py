@@ -0,0 +1,38 @@
+from collections import namedtuple
+from .expense_rollup import apply_expense_changes
+from .expense_forecast import lock_forecast_states, apply_forecast_changes
+from .expense_search import apply_search_changes
+from .budget_alerts import apply_budget_alerts
+from .data_version import bump_data_version, EXPENSES
+
+# The column values of an expense before or after a change
+ExpenseSnapshot = namedtuple('ExpenseSnapshot', ['id', 'user_id', 'category_id', 'date', 'amount', 'title',
+                                                 'description'])
+
+
+# To take a snapshot of an Expense object, or of a row with the same columns
+def snapshot(expense):
+    return ExpenseSnapshot(expense.id, expense.user_id, expense.category_id, expense.date, expense.amount,
+                           expense.title, expense.description)
+
+
+# To keep the data derived from the expenses in step with a change, in the caller's transaction. Call it after
+# adding and updating expenses (once they have their ids) but before deleting them
+# removed holds the snapshots of the expenses before they were updated or deleted, added the snapshots of
+# the expenses after they were added or updated
+# Returns the budget status of each (user_id, category_id) whose current month total changed
+def sync_expense_changes(removed=(), added=()):
+    removed, added = list(removed), list(added)
+
+    # The forecast states are locked before the monthly totals, in the same order as the prediction job
+    forecast_states = lock_forecast_states(removed, added)
+    apply_expense_changes(removed, added)
+    apply_forecast_changes(removed, added, forecast_states)
+    apply_search_changes(removed, added)
+    budget_statuses = apply_budget_alerts(removed, added)
+
+    # Mark the expense lists of the users as changed
+    for user_id in sorted({expense.user_id for expense in removed + added}):
+        bump_data_version(user_id, EXPENSES)
+
+    return budget_statuses
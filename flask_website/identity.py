@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from flask_jwt_extended import get_jwt_identity
+from .models import User
+import os
+import threading
+import time
+
+
+# Small in-process cache of the user profiles (without the password hash), so routes that only show the
+# username, email or notification setting do not query the user on every call. Each process has its own cache,
+# a change made through another process is seen after at most ttl seconds
+class UserCache:
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # To get the cached profile of a user, None if it is not cached or has expired
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            profile, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return profile
+
+    # To cache the profile of a user, dropping the least recently used profile when full
+    def set(self, user_id, profile):
+        with self._lock:
+            self._entries[user_id] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # To drop the cached profile of a user after it changed or was deleted
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    # To drop every cached profile
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(max_size=int(os.getenv('USER_CACHE_SIZE', 1024)),
+                       ttl=float(os.getenv('USER_CACHE_TTL', 60)))
+
+
+# To get the id of the authenticated user from the JWT, the signed token is the proof the user exists, so
+# routes that only read or write rows by user_id do not need to query the user
+def current_user_id():
+    return int(get_jwt_identity())
+
+
+# To get the profile (id, username, email, notification_enabled) of a user, None if the user does not exist
+def get_user_profile(user_id):
+    user_id = int(user_id)
+
+    profile = user_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    user = User.query.with_entities(User.id, User.username, User.email, User.notification_enabled) \
+        .filter_by(id=user_id).first()
+    if user is None:
+        return None
+
+    profile = {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'notification_enabled': user.notification_enabled,
+    }
+    user_cache.set(user_id, profile)
+
+    return profile
+
+
+# To get the profile of the authenticated user
+def current_user_profile():
+    return get_user_profile(current_user_id())
+
+
+# To drop the cached profile of a user, call it after committing a change to the username, email or
+# notification setting, or deleting the user
+def invalidate_user(user_id):
+    user_cache.invalidate(int(user_id))
@@ -0,0 +1,113 @@
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+import time
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Groups the items submitted by concurrent requests into batches for one predict call.
+
+    A dedicated worker thread takes the first waiting item, then keeps collecting items until window
+    seconds have passed or max_batch_size items are collected, calls predict_batch once with all of them
+    and resolves the future of each caller with its own result.
+
+    The worker thread is started on the first submit, and again if the process was forked since, so a
+    batcher created before gunicorn forks its workers runs one thread per worker.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=64, window=0.002):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Metrics of the batches run so far
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.errors = 0
+
+    # To start the worker thread if it is not running in this process
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                # Items queued in the parent before the fork can never be answered in this process
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='categorizer-batcher', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    # To queue one item and get a future resolved with its result
+    def submit(self, item):
+        self._ensure_started()
+
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    # To get the result of one item, waiting for the batch it is part of
+    def predict(self, item, timeout=5):
+        return self.submit(item).result(timeout=timeout)
+
+    # To collect the next batch, blocking until at least one item is waiting
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            # Skip the items whose caller cancelled the future while it was waiting
+            batch = [(item, future) for item, future in self._next_batch() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.predict_batch(items)
+            except Exception as e:
+                logger.error(e)
+                self.errors += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            self.batches += 1
+            self.items += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+
+    # To get the queue depth and the batch size metrics
+    def metrics(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'items': self.items,
+            'average_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'errors': self.errors,
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+        }
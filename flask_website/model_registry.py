@@ -0,0 +1,177 @@
+from collections import namedtuple
+import gc
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import joblib
+import numpy as np
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# Get the directory path of the current script
+current_dir = os.path.dirname(__file__)
+
+# Define the path to the folder containing the model files
+models_dir = os.path.join(current_dir, 'machine_learning_models', 'categorize_expense')
+
+# The trained model and vectorizer loaded together, with the version of the artifacts they were loaded from
+Categorizer = namedtuple('Categorizer', ['nb_model', 'vectorizer', 'version'])
+
+# Fitted attributes of the Naive Bayes model stored as .npy files in the arrays format
+NB_ARRAYS = ['classes_', 'class_count_', 'feature_count_', 'feature_log_prob_', 'class_log_prior_']
+
+
+class ModelRegistry:
+    """Loads the expense categorizer on first use and reloads it when its artifacts change.
+
+    Two formats are supported:
+      pickle - nb_model.pkl and vectorizer.pkl written by joblib (the default)
+      arrays - a directory of .npy files written by export_arrays, memory-mapped read only so every
+               process maps the same pages of the page cache instead of holding a private copy
+
+    Calling preload() before the web server forks its workers loads the model once in the parent, the
+    workers then share those pages copy-on-write.
+    """
+
+    def __init__(self, directory, model_format='pickle', check_interval=30):
+        if model_format not in ('pickle', 'arrays'):
+            raise ValueError(f'Unknown model format {model_format}, expected pickle or arrays.')
+
+        self.directory = directory
+        self.model_format = model_format
+        self.check_interval = check_interval
+        self._categorizer = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def model_path(self):
+        return os.path.join(self.directory, 'nb_model.pkl')
+
+    @property
+    def vectorizer_path(self):
+        return os.path.join(self.directory, 'vectorizer.pkl')
+
+    @property
+    def arrays_dir(self):
+        return os.path.join(self.directory, 'arrays')
+
+    # To get the files the current format loads from
+    def _artifact_paths(self):
+        if self.model_format == 'arrays':
+            return [os.path.join(self.arrays_dir, 'manifest.json')]
+        return [self.model_path, self.vectorizer_path]
+
+    # To get a short version string that changes whenever one of the model artifacts is replaced
+    def _artifacts_version(self):
+        signature = [(os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in self._artifact_paths()]
+        return hashlib.sha1(repr(signature).encode()).hexdigest()[:12]
+
+    # To load the model and vectorizer in the configured format
+    def _load(self):
+        version = self._artifacts_version()
+        started = time.perf_counter()
+
+        if self.model_format == 'arrays':
+            nb_model, vectorizer = self._load_arrays()
+        else:
+            nb_model, vectorizer = joblib.load(self.model_path), joblib.load(self.vectorizer_path)
+
+        logger.info(f'Loaded the expense categorizer ({self.model_format}, version {version}) '
+                    f'in {time.perf_counter() - started:.3f}s.')
+
+        return Categorizer(nb_model, vectorizer, version)
+
+    # To rebuild the fitted model and vectorizer from the memory-mapped arrays
+    def _load_arrays(self):
+        # Imported here so processes that never predict do not pay for importing scikit-learn
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+
+        with open(os.path.join(self.arrays_dir, 'manifest.json')) as file:
+            manifest = json.load(file)
+
+        def load_array(name):
+            return np.load(os.path.join(self.arrays_dir, f'{name}.npy'), mmap_mode='r')
+
+        nb_model = MultinomialNB(**manifest['nb_params'])
+        for name in NB_ARRAYS:
+            setattr(nb_model, name, load_array(name))
+        nb_model.n_features_in_ = manifest['n_features']
+
+        vectorizer_params = dict(manifest['vectorizer_params'], dtype=np.dtype(manifest['vectorizer_dtype']).type,
+                                 ngram_range=tuple(manifest['vectorizer_params']['ngram_range']))
+        vectorizer = TfidfVectorizer(**vectorizer_params)
+
+        # The vocabulary is stored as the terms in column order, the term to column mapping is rebuilt from it
+        vectorizer.vocabulary_ = {str(term): column for column, term in enumerate(load_array('vocabulary'))}
+        vectorizer.fixed_vocabulary_ = False
+        vectorizer.stop_words_ = set()
+        vectorizer.idf_ = load_array('idf')
+
+        return nb_model, vectorizer
+
+    # To get the loaded categorizer, loading it on first use and reloading it when the artifacts changed
+    # (checked at most every check_interval seconds)
+    def get(self):
+        categorizer = self._categorizer
+        if categorizer is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return categorizer
+
+        with self._lock:
+            if self._categorizer is None:
+                self._categorizer = self._load()
+            elif time.monotonic() - self._checked_at >= self.check_interval:
+                if self._artifacts_version() != self._categorizer.version:
+                    logger.info('Model artifacts changed, reloading the expense categorizer.')
+                    self._categorizer = self._load()
+            self._checked_at = time.monotonic()
+
+            return self._categorizer
+
+    # To load the categorizer now, before the workers are forked, so they share its memory
+    def preload(self):
+        categorizer = self.get()
+
+        # Move everything allocated so far out of the garbage collector's generations, so collections in
+        # the workers do not write to these objects and copy their pages
+        gc.collect()
+        gc.freeze()
+
+        return categorizer
+
+    # To write the fitted model and vectorizer loaded from the pickles as memory-mappable .npy files
+    def export_arrays(self):
+        nb_model, vectorizer = joblib.load(self.model_path), joblib.load(self.vectorizer_path)
+        os.makedirs(self.arrays_dir, exist_ok=True)
+
+        for name in NB_ARRAYS:
+            np.save(os.path.join(self.arrays_dir, f'{name}.npy'), np.asarray(getattr(nb_model, name)))
+
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        np.save(os.path.join(self.arrays_dir, 'vocabulary.npy'), np.array(terms, dtype=str))
+        np.save(os.path.join(self.arrays_dir, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float64))
+
+        vectorizer_params = vectorizer.get_params()
+        vectorizer_dtype = np.dtype(vectorizer_params.pop('dtype')).name
+
+        # The manifest is written last, its change is what makes running registries reload the arrays
+        manifest = {
+            'nb_params': nb_model.get_params(),
+            'n_features': int(nb_model.n_features_in_),
+            'vectorizer_params': vectorizer_params,
+            'vectorizer_dtype': vectorizer_dtype,
+        }
+        with open(os.path.join(self.arrays_dir, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+
+        return self.arrays_dir
+
+
+# The registry of the expense categorizer shared by the whole process
+categorizer_registry = ModelRegistry(models_dir, model_format=os.getenv('CATEGORIZER_FORMAT', 'pickle'),
+                                     check_interval=float(os.getenv('MODEL_CHECK_INTERVAL', 30)))
@@ -38,14 +38,89 @@ class Expense(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Serve the (date, id) keyset pagination of a user's expenses, and a user's expenses in a date range, as
+    # index range scans
+    __table_args__ = (
+        db.Index('ix_expense_user_id_date_id', 'user_id', 'date', 'id'),
+    )
+
     def __repr__(self):
         return f'<Expense {self.id} : {self.title}, {self.description if self.description else "No description"}>'
 
 
+class MonthlyExpenseTotal(db.Model):
+    # Total and number of a user's expenses in one category for one month (in time_window.LOCAL_TIMEZONE),
+    # kept up to date in the same transaction as every change to the expenses
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<MonthlyExpenseTotal User {self.user_id} - Category {self.category_id} - {self.year}/{self.month}>'
+
+
+class ExpenseForecastState(db.Model):
+    # Least squares sums of a user's category over its monthly totals up to through_period (year * 100 + month),
+    # x being the index of the month among the months with a total and y its total. The months after
+    # through_period are folded in by the prediction job, changes to the months up to it update the sums with
+    # the change of the expenses
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    through_period = db.Column(db.Integer, nullable=False, default=0)
+    n = db.Column(db.Integer, nullable=False, default=0)
+    sum_x = db.Column(db.BigInteger, nullable=False, default=0)
+    sum_x2 = db.Column(db.BigInteger, nullable=False, default=0)
+    sum_y = db.Column(db.Numeric(18, 2), nullable=False, default=0)
+    sum_xy = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ExpenseForecastState User {self.user_id} - Category {self.category_id} - {self.through_period}>'
+
+
+class ExpenseSearchToken(db.Model):
+    # Inverted index of the expense titles and descriptions, one row per distinct normalized token of an
+    # expense, kept up to date in the same transaction as every change to the expenses
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), primary_key=True, autoincrement=False)
+    token = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    # Serve the lookup of a user's expenses having a token as an index range scan that does not read the rows
+    __table_args__ = (
+        db.Index('ix_expense_search_token_user_id_token_expense_id', 'user_id', 'token', 'expense_id'),
+    )
+
+    def __repr__(self):
+        return f'<ExpenseSearchToken Expense {self.expense_id}: {self.token}>'
+
+
+class DataVersion(db.Model):
+    # Version of one resource list of a user, increased in the same transaction as every change to it, so the
+    # list endpoints can answer 304 Not Modified from this row alone. Changes that are not per user (categories,
+    # or jobs updating every user) use user_id 0
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    resource = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion User {self.user_id} - {self.resource}: {self.version}>'
+
+
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # Whether the month total reached the amount in alert_period, a flag of an earlier period reads as not exceeded
     is_exceed = db.Column(db.Boolean, default=False)
+
+    # Percents of the amount that notify the user, comma separated, None for budget_alerts.DEFAULT_ALERT_THRESHOLDS
+    alert_thresholds = db.Column(db.String(50), nullable=True)
+
+    # Highest threshold already notified in alert_period (year * 100 + month), so each one notifies once a month
+    # alert_period is the month of both alert_level and is_exceed, so a new month needs no reset of every budget
+    alert_level = db.Column(db.Integer, nullable=False, default=0)
+    alert_period = db.Column(db.Integer, nullable=False, default=0)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), index=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, nullable=False)
 
@@ -63,3 +138,28 @@ class Notification(db.Model):
 
     def __repr__(self):
         return f'<Notification {self.id}: {self.message}>'
+
+
+class PredictionShardCheckpoint(db.Model):
+    # A shard of users (shard * shard_size < user_id <= (shard + 1) * shard_size) whose monthly prediction is
+    # done for period (year * 100 + month), committed with the shard's notifications so a restarted run skips it
+    period = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard_size = db.Column(db.Integer, nullable=False)
+    budgets = db.Column(db.Integer, nullable=False, default=0)
+    notified = db.Column(db.Integer, nullable=False, default=0)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PredictionShardCheckpoint {self.period} - Shard {self.shard}>'
+
+
+class SchedulerLease(db.Model):
+    # A lease held by one process of the cluster until expires_at (UTC), renewed by its holder while it is
+    # alive, so the scheduled jobs run in that process only and move to another one when it dies
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} - {self.holder}>'
@@ -0,0 +1,68 @@
+import os
+import sys
+
+# Get the directory path of the current script
+current_dir = os.path.dirname(__file__)
+
+# Local folder searched first for the nltk data, it can hold vendored copies of the resources
+NLTK_DATA_DIR = os.getenv('NLTK_DATA_DIR', os.path.join(current_dir, 'nltk_data'))
+
+# The nltk resources used by the text preprocessing, by download name and path inside the data folder
+REQUIRED_RESOURCES = {
+    'stopwords': 'corpora/stopwords',
+    'punkt': 'tokenizers/punkt',
+}
+
+
+# To make nltk look in the local data folder before its default locations
+def use_local_data_dir():
+    # nltk reads NLTK_DATA when it is imported, so set it if nltk has not been imported yet, which avoids
+    # importing the whole nltk package during startup
+    if 'nltk' not in sys.modules:
+        paths = os.environ.get('NLTK_DATA', '').split(os.pathsep)
+        if NLTK_DATA_DIR not in paths:
+            os.environ['NLTK_DATA'] = os.pathsep.join([NLTK_DATA_DIR] + [path for path in paths if path])
+        return
+
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+
+# To check whether a resource is in the local data folder, as a folder or as the zip nltk can also read
+def _in_local_data_dir(resource_path):
+    path = os.path.join(NLTK_DATA_DIR, *resource_path.split('/'))
+    return os.path.isdir(path) or os.path.isfile(path + '.zip')
+
+
+# To get the names of the required resources that cannot be found, without any network access
+def find_missing_resources():
+    use_local_data_dir()
+
+    # Only import nltk to search its other locations when a resource is not in the local data folder
+    missing = [name for name, resource_path in REQUIRED_RESOURCES.items() if not _in_local_data_dir(resource_path)]
+    if not missing:
+        return missing
+
+    import nltk
+
+    use_local_data_dir()
+
+    still_missing = []
+    for name in missing:
+        try:
+            nltk.data.find(REQUIRED_RESOURCES[name])
+        except LookupError:
+            still_missing.append(name)
+
+    return still_missing
+
+
+# To download the required resources into the local data folder, only run by the setup command
+def download_resources(data_dir=NLTK_DATA_DIR):
+    import nltk
+
+    os.makedirs(data_dir, exist_ok=True)
+
+    return {name: nltk.download(name, download_dir=data_dir, quiet=True) for name in REQUIRED_RESOURCES}
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import User, Notification
+from .models import Notification
+from .data_version import etag_versioned, bump_data_version, NOTIFICATIONS
 from . import db
 import logging
 
@@ -14,31 +15,25 @@ logger = logging.getLogger(__name__)
 # Get all notifications for the current user
 @notifications.route('')
 @jwt_required()
+@etag_versioned(NOTIFICATIONS)
 def get_notifications():
     try:
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
+        # Access notifications associated with the user through the relationship
+        notifications = Notification.query.filter_by(user_id=user_id).all()
 
-        if user:
+        # Serialize the notifications to JSON
+        serialized_notifications = [{
+            'id': notification.id,
+            'title': notification.title,
+            'message': notification.message,
+            'has_read': notification.has_read,
+            'date_created': notification.date_created
+        } for notification in notifications]
 
-            # Access notifications associated with the user through the relationship
-            notifications = Notification.query.filter_by(user_id=user_id).all()
-
-            # Serialize the notifications to JSON
-            serialized_notifications = [{
-                'id': notification.id,
-                'title': notification.title,
-                'message': notification.message,
-                'has_read': notification.has_read,
-                'date_created': notification.date_created
-            } for notification in notifications]
-
-            return jsonify({'notifications': serialized_notifications}), 200
-        else:
-            return jsonify({'message': 'User not found'}), 404
+        return jsonify({'notifications': serialized_notifications}), 200
 
     except Exception as e:
         logger.error(e)
@@ -60,6 +55,7 @@ def mark_as_read(notification_id):
         if notification:
             # Mark the notification as read
             notification.has_read = True
+            bump_data_version(user_id, NOTIFICATIONS)
             db.session.commit()
 
             return jsonify({'message': f'Notification {notification_id} marked as read.'}), 200
@@ -82,19 +78,13 @@ def mark_all_as_read():
         # Get the user ID
         user_id = get_jwt_identity()
 
-        # Query the database to find the authenticated user
-        user = User.query.get(user_id)
+        # Mark all unread notifications of the user as read with one update statement
+        Notification.query.filter_by(user_id=user_id, has_read=False).update({'has_read': True})
 
-        if user:
-            # Mark all notifications as read for the user
-            for notification in user.notifications:
-                notification.has_read = True
+        bump_data_version(user_id, NOTIFICATIONS)
+        db.session.commit()
 
-            db.session.commit()
-
-            return jsonify({'message': 'All notifications marked as read.'}), 200
-        else:
-            return jsonify({'message': 'User not found'}), 404
+        return jsonify({'message': 'All notifications marked as read.'}), 200
 
     except Exception as e:
         # Rollback changes if an error occurs
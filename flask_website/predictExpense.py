@@ -1,108 +1,225 @@
-from collections import defaultdict
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-import datetime
-import pytz
-import numpy as np
-from sklearn.linear_model import LinearRegression
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import and_, insert, func
+from sqlalchemy.exc import IntegrityError
+import logging
+import multiprocessing
+import os
+import time
 
 # Initialize the scheduler
 scheduler = BackgroundScheduler()
 
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# Number of users per shard, each shard is one history query, one notification insert and one commit
+PREDICT_SHARD_SIZE = int(os.getenv('PREDICT_SHARD_SIZE', 10000))
 
-# Function to train and predict expenses
-def train_and_predict_expenses(db, app):
+# Number of processes running the shards, 1 runs them in the scheduler thread
+PREDICT_WORKERS = int(os.getenv('PREDICT_WORKERS', 1))
 
-    from .models import User, Expense, Notification
-    with app.app_context():
-        with db.session.begin():
-            # Get all users
-            users = User.query.all()
+# Text of the notification sent when the predicted expense of the current month exceeds the budget
+PREDICTION_TITLE = "Budget Exceedance Prediction Alert"
+PREDICTION_MESSAGE = "The predicted expense for {category_name} in the current month suggests a rising trend. " \
+                     "Consider adjusting your spending to avoid exceeding the budget.\n\nNote: Please be aware " \
+                     "that this prediction is based on historical data and may not be entirely accurate."
+
+
+# To get the budgets of the users in (low_user_id, high_user_id] whose predicted current month expense exceeds
+# their amount, from the forecast sums of their categories without reading the monthly totals again. Returns
+# the list of (user_id, category_id) of the budgets to notify, and the number of budgets predicted. The
+# advanced forecast states are committed, the notifications are left to the caller
+def predict_budget_chunk(db, low_user_id, high_user_id, current_year, current_month):
+    from .models import Budget, ExpenseForecastState
+    from .expense_forecast import create_forecast_states, advance_forecast_states, forecast_next_value
+    from .time_window import previous_year_month
+
+    # Create the states of the new budgets in a transaction of their own, so the next one can lock every state
+    # before it reads any total
+    create_forecast_states(low_user_id, high_user_id)
+    db.session.commit()
+
+    # Fold the months closed since the last run into the sums, the prediction uses the months before this one.
+    # Committed at once, so the expense changes of the shard's users only wait for the states to advance
+    previous_year, previous_month = previous_year_month(current_year, current_month)
+    advance_forecast_states(low_user_id, high_user_id, previous_year * 100 + previous_month)
+    db.session.commit()
+
+    # Budgets without any past month have nothing to learn from and are left out
+    rows = db.session.query(
+        Budget.user_id, Budget.category_id, Budget.amount, ExpenseForecastState.n, ExpenseForecastState.sum_x,
+        ExpenseForecastState.sum_x2, ExpenseForecastState.sum_y, ExpenseForecastState.sum_xy
+    ).join(ExpenseForecastState, and_(
+        ExpenseForecastState.user_id == Budget.user_id,
+        ExpenseForecastState.category_id == Budget.category_id
+    )).filter(
+        Budget.user_id > low_user_id,
+        Budget.user_id <= high_user_id,
+        ExpenseForecastState.n > 0
+    ).order_by(Budget.id).all()
+
+    notify = []
+    for user_id, category_id, amount, *sums in rows:
+        prediction = forecast_next_value(*sums)
 
-            # For each user's budget
-            for user in users:
-                for budget in user.budgets:
+        # Rounded and compared with the Decimal amount like a single prediction
+        if round(float(prediction), 2) > amount:
+            notify.append((user_id, category_id))
 
-                    # Get the current date and time in Malaysia time zone
-                    malaysia_timezone = pytz.timezone('Asia/Kuala_Lumpur')
-                    today_malaysia = datetime.datetime.now(malaysia_timezone)
+    return notify, len(rows)
 
-                    # Convert the Malaysia time to UTC time
-                    today_utc = today_malaysia.astimezone(pytz.utc)
 
-                    # Set the time to Malaysia time 12:00 AM
-                    today_utc_midnight = today_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+# To predict the budgets of one shard of users and notify them, committing the notifications together with the
+# shard's checkpoint. Returns (budgets, notified), or None when the shard was already done for the period
+def run_prediction_shard(db, shard, shard_size, current_year, current_month):
+    from .models import Category, Notification, PredictionShardCheckpoint
+    from .data_version import bump_data_versions, NOTIFICATIONS
+    period = current_year * 100 + current_month
 
-                    # Query expenses for the user before the first day of current month
-                    expenses = Expense.query.filter(Expense.user_id == user.id,
-                                                    Expense.date < today_utc_midnight,
-                                                    Expense.category_id == budget.category_id).all()
+    done = db.session.get(PredictionShardCheckpoint, (period, shard)) is not None
 
-                    # Dictionary to store total expenses for each year and month
-                    monthly_total_expenses = defaultdict(float)
+    # End the transaction of the check, the forecast states are advanced in transactions of their own
+    db.session.rollback()
+    if done:
+        return None
 
-                    # Iterate over the expenses to sum up total expenses for each year and month
-                    for expense in expenses:
-                        # Convert the UTC date to Malaysia time zone
-                        date_malaysia = expense.date.astimezone(pytz.timezone('Asia/Kuala_Lumpur'))
+    try:
+        notify, budgets = predict_budget_chunk(db, shard * shard_size, (shard + 1) * shard_size,
+                                               current_year, current_month)
 
-                        # Get the year and month
-                        year_month = (date_malaysia.year, date_malaysia.month)
+        if notify:
+            category_names = {category.id: category.name for category in Category.query.all()}
 
-                        # Add the expense amount to the corresponding year and month
-                        monthly_total_expenses[year_month] += float(expense.amount)
+            # Create the notifications indicating the budget may be exceeded, with one insert statement
+            db.session.execute(insert(Notification), [{
+                'title': PREDICTION_TITLE,
+                'message': PREDICTION_MESSAGE.format(category_name=category_names[category_id]),
+                'user_id': user_id
+            } for user_id, category_id in notify])
+            bump_data_versions([user_id for user_id, _ in notify], NOTIFICATIONS)
 
-                    # Sort the total expenses by year and month in ascending order
-                    sorted_monthly_total_expenses = sorted(monthly_total_expenses.items())
+        db.session.add(PredictionShardCheckpoint(period=period, shard=shard, shard_size=shard_size, budgets=budgets,
+                                                 notified=len(notify)))
 
-                    # Extract the amounts into an array, rounded to 2 decimal places
-                    history_expenses = [amount for _, amount in sorted_monthly_total_expenses]
+        # Commit the changes to the database
+        db.session.commit()
 
-                    # print(user.username, budget.category.name)
-                    # print(history_expenses)
+    except IntegrityError:
+        # Another run completed the shard meanwhile, its checkpoint keeps this one from notifying twice
+        db.session.rollback()
+        return None
 
-                    X_train = np.arange(len(history_expenses)).reshape(-1, 1)  # Month index as feature
-                    y_train = history_expenses  # Historical monthly expenses as target
+    return budgets, len(notify)
 
-                    # Train the model using the data
-                    model = LinearRegression()
-                    model.fit(X_train, y_train)
 
-                    # To predict the next month which already is current month possible value based on the past
-                    # months' total amount
-                    next_month_index = len(history_expenses)
-                    next_month_expense = model.predict([[next_month_index]])
-                    next_month_expense = round(float(next_month_expense[0]), 2)
+# The app of a worker process of the prediction pool, created by _init_prediction_worker
+_worker_app = None
 
-                    # print('prediction:', next_month_expense)
 
-                    # If the predicted total expense exceeds the budget, then send notification to tell user
-                    if next_month_expense > budget.amount:
-                        # Create a notification indicating the budget may be exceeded
-                        notification = Notification(
-                            title="Budget Exceedance Prediction Alert",
-                            message=f"The predicted expense for {budget.category.name} in the current month suggests "
-                                    f"a rising trend. Consider adjusting your spending to avoid exceeding the "
-                                    f"budget.\n\nNote: Please be aware that this prediction is based on historical "
-                                    f"data and may not be entirely accurate.",
-                            user_id=user.id
-                        )
-                        db.session.add(notification)
+# To create the app in a new worker process of the prediction pool, without its schedulers
+def _init_prediction_worker():
+    global _worker_app
+    os.environ['START_SCHEDULERS'] = '0'
 
-                    # Explicitly delete the model
-                    del model
+    from . import create_app
+    _worker_app = create_app()
 
-            # Commit the changes to the database
-            db.session.commit()
+
+# To run one shard in a worker process of the prediction pool
+def _run_prediction_shard_in_worker(shard, shard_size, current_year, current_month):
+    from . import db
+    with _worker_app.app_context():
+        return shard, run_prediction_shard(db, shard, shard_size, current_year, current_month)
+
+
+# Function to train and predict expenses
+# Predicts the current month expense of every budget from a linear trend over its past monthly totals, and
+# notifies the users whose prediction exceeds the budget. The users are split in id-range shards of shard_size
+# users, each shard predicts from the stored least squares sums of its budgets (the same predictions as one
+# LinearRegression per budget) and is committed with its checkpoint, so a restarted run only does the shards
+# not done yet. With more than one worker, the shards run on a pool of processes
+def train_and_predict_expenses(db, app, workers=None, shard_size=None):
+    from .models import User, PredictionShardCheckpoint
+    from .time_window import current_year_month
+    workers = workers or PREDICT_WORKERS
+    shard_size = shard_size or PREDICT_SHARD_SIZE
+
+    with app.app_context():
+        # Get the current year and month in Malaysia time zone
+        current_year, current_month = current_year_month()
+        period = current_year * 100 + current_month
+
+        # A resumed run keeps the shard size of the run it resumes, so its shards cover the same users
+        done = db.session.query(PredictionShardCheckpoint.shard, PredictionShardCheckpoint.shard_size).filter_by(
+            period=period).all()
+        if done and done[0].shard_size != shard_size:
+            logger.warning(f'Expense prediction {period}: resuming with the shard size {done[0].shard_size} of '
+                           f'the shards already done instead of {shard_size}')
+            shard_size = done[0].shard_size
+
+        # The shards cover the user ids up to the highest one, skipping the ones already done for this month
+        max_user_id = db.session.query(func.max(User.id)).scalar() or 0
+        done_shards = {row.shard for row in done}
+        shards = [shard for shard in range((max_user_id - 1) // shard_size + 1) if shard not in done_shards]
+        db.session.rollback()
+
+        logger.info(f'Expense prediction {period}: {len(shards)} shards of {shard_size} users to run, '
+                    f'{len(done_shards)} already done, {workers} workers')
+
+        started = time.monotonic()
+        totals = {'shards': 0, 'budgets': 0, 'notified': 0, 'failed': 0}
+
+        # To log the progress and throughput after each shard
+        def report(shard, result):
+            totals['shards'] += 1
+            if result is not None:
+                totals['budgets'] += result[0]
+                totals['notified'] += result[1]
+            elapsed = time.monotonic() - started
+            logger.info(f"Expense prediction {period}: shard {shard} done ({totals['shards']}/{len(shards)}), "
+                        f"{totals['budgets']} budgets, {totals['notified']} notified, "
+                        f"{totals['budgets'] / elapsed if elapsed else 0:.0f} budgets/s")
+
+        if workers <= 1:
+            for shard in shards:
+                try:
+                    report(shard, run_prediction_shard(db, shard, shard_size, current_year, current_month))
+                except Exception as e:
+                    # The shard is not checkpointed, so the next run retries it
+                    db.session.rollback()
+                    totals['failed'] += 1
+                    logger.error(f'Expense prediction {period}: shard {shard} failed: {e}')
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_prediction_worker) as pool:
+                futures = {pool.submit(_run_prediction_shard_in_worker, shard, shard_size, current_year,
+                                       current_month): shard for shard in shards}
+                for future in as_completed(futures):
+                    try:
+                        report(*future.result())
+                    except Exception as e:
+                        totals['failed'] += 1
+                        logger.error(f'Expense prediction {period}: shard {futures[future]} failed: {e}')
+
+        logger.info(f"Expense prediction {period} finished in {time.monotonic() - started:.1f}s: "
+                    f"{totals['budgets']} budgets, {totals['notified']} notified, {totals['failed']} shards failed")
+
+        return totals
 
 
 # Start the scheduler
 def start_predict_expense_scheduler(db, app):
-    # Define the cron trigger to execute the task on the first day of each month at 12:15 AM
-    trigger = CronTrigger(day='1', hour='0', minute='15')
+    from .time_window import LOCAL_TIMEZONE
+    from .scheduler_lease import add_leader_job
+
+    # Define the cron trigger to execute the task on the first day of each month at 12:15 AM, in the timezone
+    # the months are counted in
+    trigger = CronTrigger(day='1', hour='0', minute='15', timezone=LOCAL_TIMEZONE)
 
-    # Add the job with the specified trigger
-    scheduler.add_job(train_and_predict_expenses, trigger, args=[db, app])
+    # Add the job with the specified trigger, run by the scheduler leader only
+    add_leader_job(scheduler, train_and_predict_expenses, trigger, db, app)
 
     # Start the scheduler
     scheduler.start()
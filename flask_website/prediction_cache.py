@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class PredictionCache:
+    """Bounded LRU cache of category predictions with a time to live.
+
+    Entries are stored for one model version. When a different version is seen (the model artifacts
+    were reloaded), every entry is dropped so no prediction of the old model is returned.
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # To drop every entry if the model version changed, must be called with the lock held
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    # To get the cached prediction of the normalized text, or None if it is missing or expired
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Mark the entry as the most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # To store the prediction of the normalized text, evicting the least recently used entries when full
+    def set(self, key, value, version):
+        with self._lock:
+            self._check_version(version)
+
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # To get the size and the hit/miss counters of the cache
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'model_version': self._version,
+            }
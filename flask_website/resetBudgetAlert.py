@@ -1,28 +1,64 @@
-from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+import logging
+import os
 
 # Initialize the scheduler
 scheduler = BackgroundScheduler()
 
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# Number of budgets reset per transaction, so each batch only locks a few rows for a short time
+RESET_BATCH_SIZE = int(os.getenv('BUDGET_RESET_BATCH_SIZE', 1000))
+
 
 # Function to update is_exceed to 0
-def update_is_exceed(db, app):
+# The is_exceed flag of a budget only holds for its alert_period, so a stale flag already reads as not exceeded.
+# This only clears the stale flags, in small batches of budgets ordered by id, each committed on its own
+def update_is_exceed(db, app, batch_size=RESET_BATCH_SIZE):
     from .models import Budget
+    from .budget_alerts import alert_period
+    from .time_window import current_year_month
     with app.app_context():
-        with db.session.begin():
-            Budget.query.update({"is_exceed": False})
+        period = alert_period(*current_year_month())
+
+        last_id = 0
+        reset = 0
+        while True:
+            # Find the next batch of budgets with a flag from an earlier month
+            budget_ids = [budget_id for budget_id, in db.session.query(Budget.id).filter(
+                Budget.id > last_id,
+                Budget.is_exceed.is_(True),
+                Budget.alert_period < period
+            ).order_by(Budget.id).limit(batch_size)]
+
+            if not budget_ids:
+                break
+
+            # The period is checked again, a budget flagged for this month since the select keeps its flag
+            reset += Budget.query.filter(
+                Budget.id.in_(budget_ids),
+                Budget.alert_period < period
+            ).update({'is_exceed': False}, synchronize_session=False)
             db.session.commit()
-        print("is_exceed updated to 0 at:", datetime.now())
+
+            last_id = budget_ids[-1]
+
+        logger.info(f'is_exceed updated to 0 for {reset} budgets')
 
 
 # Start the scheduler
 def start_scheduler(db, app):
-    # Define the cron trigger to execute on the first day of the month at 12:00 AM
-    trigger = CronTrigger(day='1', hour='0')
+    from .time_window import LOCAL_TIMEZONE
+    from .scheduler_lease import add_leader_job
+
+    # Define the cron trigger to execute on the first day of the month at 12:00 AM, in the timezone the months
+    # are counted in
+    trigger = CronTrigger(day='1', hour='0', timezone=LOCAL_TIMEZONE)
 
-    # Add the job with the specified trigger
-    scheduler.add_job(update_is_exceed, trigger, args=[db, app])
+    # Add the job with the specified trigger, run by the scheduler leader only
+    add_leader_job(scheduler, update_is_exceed, trigger, db, app)
 
     # Start the scheduler
     scheduler.start()
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+import atexit
+import logging
+import os
+import pytz
+import socket
+import uuid
+
+# Initialize the scheduler renewing the lease, separate from the job schedulers so it keeps renewing while a
+# long job runs
+scheduler = BackgroundScheduler()
+
+# Get a logger for logging
+logger = logging.getLogger(__name__)
+
+# The lease electing the process running the scheduled jobs
+LEADER_LEASE = 'scheduler'
+
+# Seconds a lease lasts without renewal, a dead leader is replaced after at most this long
+LEASE_TTL = int(os.getenv('SCHEDULER_LEASE_TTL', 60))
+
+# Seconds between two renewals of the lease by every process, well below LEASE_TTL
+LEASE_RENEW_INTERVAL = int(os.getenv('SCHEDULER_LEASE_RENEW_INTERVAL', 15))
+
+# A process becoming leader runs the jobs that should have run in this many seconds before, missed while the
+# previous leader was dead. The jobs are safe to run twice
+MISSED_JOB_WINDOW = int(os.getenv('SCHEDULER_MISSED_JOB_WINDOW', 3600))
+
+# Random part of the holder name, with the pid it is unique per process even for workers forked after import
+_holder_token = uuid.uuid4().hex[:8]
+
+# The jobs that only run in the leader, and whether this process held the lease at its last renewal
+_leader_jobs = []
+_leader = {'held': False}
+
+
+# To get the name this process holds the leases under
+def lease_holder():
+    return f'{socket.gethostname()}:{os.getpid()}:{_holder_token}'
+
+
+# To take or renew a lease for ttl seconds, committed at once. Returns whether this process holds it
+# The lease is taken with one conditional UPDATE, so only one process can take an expired lease. The expiry
+# uses the clock of each process, the clocks of the cluster should be far closer than LEASE_TTL
+def acquire_lease(db, name, ttl=LEASE_TTL):
+    from .models import SchedulerLease
+    holder = lease_holder()
+    now = datetime.utcnow()
+
+    try:
+        taken = SchedulerLease.query.filter(
+            SchedulerLease.name == name,
+            or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < now)
+        ).update({'holder': holder, 'expires_at': now + timedelta(seconds=ttl)}, synchronize_session=False)
+
+        # The first process to need the lease creates it
+        if not taken and db.session.get(SchedulerLease, name) is None:
+            db.session.add(SchedulerLease(name=name, holder=holder, expires_at=now + timedelta(seconds=ttl)))
+            taken = 1
+
+        db.session.commit()
+        return bool(taken)
+
+    except IntegrityError:
+        # Another process created the lease at the same time
+        db.session.rollback()
+        return False
+
+
+# To give up a lease held by this process, so another process takes it without waiting for its expiry
+def release_lease(db, name):
+    from .models import SchedulerLease
+    SchedulerLease.query.filter_by(name=name, holder=lease_holder()).delete(synchronize_session=False)
+    db.session.commit()
+
+
+# To run a scheduled job only if this process is the leader, every process schedules the job but only one
+# runs it. The lease is renewed first, so a leader that lost it meanwhile skips the job
+def run_as_leader(job, db, app):
+    with app.app_context():
+        if not acquire_lease(db, LEADER_LEASE):
+            logger.info(f'Skipping {job.__name__}, another process is the scheduler leader')
+            return
+
+    logger.info(f'Running {job.__name__} as the scheduler leader {lease_holder()}')
+    return job(db, app)
+
+
+# To add a job to a scheduler, running it with run_as_leader and running it again if it was missed because
+# the leader died
+def add_leader_job(job_scheduler, job, trigger, db, app):
+    scheduled_job = job_scheduler.add_job(run_as_leader, trigger, args=[job, db, app], id=job.__name__)
+    _leader_jobs.append(scheduled_job)
+    return scheduled_job
+
+
+# To run now the leader jobs whose fire time was in the last MISSED_JOB_WINDOW seconds
+def _run_missed_jobs():
+    now = datetime.now(pytz.utc)
+    for scheduled_job in _leader_jobs:
+        fire_time = scheduled_job.trigger.get_next_fire_time(None, now - timedelta(seconds=MISSED_JOB_WINDOW))
+        if fire_time is not None and fire_time <= now:
+            logger.info(f'Running {scheduled_job.id} missed at {fire_time}')
+            scheduled_job.modify(next_run_time=now)
+
+
+# To renew the leader lease, or take it when the leader died
+def renew_leadership(db, app):
+    with app.app_context():
+        try:
+            held = acquire_lease(db, LEADER_LEASE)
+        except Exception as e:
+            # Without the database the lease cannot be renewed, so this process may no longer be the leader
+            db.session.rollback()
+            logger.error(e)
+            held = False
+
+    if held and not _leader['held']:
+        logger.info(f'{lease_holder()} is now the scheduler leader')
+        _run_missed_jobs()
+    elif not held and _leader['held']:
+        logger.info(f'{lease_holder()} is no longer the scheduler leader')
+    _leader['held'] = held
+
+
+# To give up the leader lease when the process exits
+def _release_leadership(db, app):
+    if not _leader['held']:
+        return
+    try:
+        with app.app_context():
+            release_lease(db, LEADER_LEASE)
+    except Exception as e:
+        logger.error(e)
+
+
+# Start the scheduler
+def start_leader_election(db, app):
+    # Renew the lease every LEASE_RENEW_INTERVAL seconds, starting now
+    scheduler.add_job(renew_leadership, 'interval', seconds=LEASE_RENEW_INTERVAL, args=[db, app],
+                      next_run_time=datetime.now(pytz.utc))
+    atexit.register(_release_leadership, db, app)
+
+    # Start the scheduler
+    scheduler.start()
@@ -0,0 +1,90 @@
+from functools import lru_cache
+import re
+import threading
+
+# Patterns of the original preprocess_text, compiled once
+HTML_TAG_PATTERN = re.compile(r'<.*?>')
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-zA-Z0-9\s]')
+
+# Text made only of these characters has no sentence boundary or punctuation for nltk.word_tokenize to handle
+PLAIN_TEXT_PATTERN = re.compile(r'[a-z0-9\s]*')
+
+# The only splits nltk.word_tokenize makes inside a lowercase alphanumeric word (its MacIntyre contractions
+# that do not need an apostrophe), e.g. "cannot" is tokenized as "can" "not"
+PLAIN_CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+
+class TextNormalizer:
+    """Reusable replacement of the original preprocess_text, producing exactly the same output.
+
+    The stopword set and the stemmer are created once, the stem of each token is memoized in a bounded
+    LRU cache, and plain lowercase alphanumeric text is tokenized without running the Punkt sentence
+    tokenizer. nltk is imported and the stopword corpus is loaded on first use, so importing this module
+    is cheap and the nltk data only has to be present when text is normalized.
+    """
+
+    def __init__(self, language='english', stem_cache_size=10000):
+        self.language = language
+        self._stop_words = None
+        self._stemmer = None
+        self._lock = threading.Lock()
+        self._stem = lru_cache(maxsize=stem_cache_size)(self._stem_word)
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            with self._lock:
+                if self._stop_words is None:
+                    from nltk.corpus import stopwords
+                    self._stop_words = frozenset(stopwords.words(self.language))
+        return self._stop_words
+
+    # To stem one word, creating the stemmer on first use
+    def _stem_word(self, word):
+        if self._stemmer is None:
+            from nltk.stem import PorterStemmer
+            self._stemmer = PorterStemmer()
+        return self._stemmer.stem(word)
+
+    # To split the cleaned text into the same tokens as nltk.word_tokenize
+    def tokenize(self, text):
+        if not PLAIN_TEXT_PATTERN.fullmatch(text):
+            import nltk
+            return nltk.word_tokenize(text, self.language)
+
+        tokens = []
+        for word in text.split():
+            contraction = PLAIN_CONTRACTIONS.get(word)
+            if contraction:
+                tokens.extend(contraction)
+            else:
+                tokens.append(word)
+        return tokens
+
+    # To get the stemmed tokens of the text without the stop words
+    def tokens(self, text):
+        # Remove HTML tags, then non-alphanumeric characters, and convert to lowercase
+        text = NON_ALPHANUMERIC_PATTERN.sub('', HTML_TAG_PATTERN.sub('', text)).lower()
+
+        stop_words = self.stop_words
+        return [self._stem(word) for word in self.tokenize(text) if word not in stop_words]
+
+    # To preprocess the text before use in machine learning model
+    def normalize(self, text):
+        return ' '.join(self.tokens(text))
+
+    # To get the hit/miss counters of the stem cache
+    def cache_info(self):
+        return self._stem.cache_info()
+
+
+# The normalizer shared by the category predictions and the search index, it keeps the stopwords, stemmer and
+# stem cache between requests
+text_normalizer = TextNormalizer()
@@ -0,0 +1,41 @@
+from datetime import datetime
+import os
+import pytz
+
+# The timezone the users' months are counted in, the expense dates are stored in UTC
+LOCAL_TIMEZONE = pytz.timezone(os.getenv('APP_TIMEZONE', 'Asia/Kuala_Lumpur'))
+
+
+# To get the (year, month) in local time of an expense date, stored in database as naive UTC
+def local_year_month(date, timezone=LOCAL_TIMEZONE):
+    if date.tzinfo is None:
+        date = pytz.utc.localize(date)
+    local_date = date.astimezone(timezone)
+    return local_date.year, local_date.month
+
+
+# To get the current (year, month) in local time
+def current_year_month(timezone=LOCAL_TIMEZONE):
+    today = datetime.now(timezone)
+    return today.year, today.month
+
+
+# To get the (year, month) after the given one
+def next_year_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+# To get the (year, month) before the given one
+def previous_year_month(year, month):
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+# To get the naive UTC datetime at which a local month starts
+def month_start(year, month, timezone=LOCAL_TIMEZONE):
+    return timezone.localize(datetime(year, month, 1)).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+# To get the half-open [start, end) range of a local month in naive UTC, comparable with Expense.date so a
+# filter on it is an index range scan instead of extract() on every row
+def month_window(year, month, timezone=LOCAL_TIMEZONE):
+    return month_start(year, month, timezone), month_start(*next_year_month(year, month), timezone)
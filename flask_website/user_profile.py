@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import User
+from .identity import get_user_profile, invalidate_user
 from . import bcrypt, db
 import logging
 
@@ -19,13 +20,6 @@ def update_username():
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
-
-        # Check the user is existed or not
-        if user is None:
-            return jsonify({'message': 'Account Not Found'}), 404
-
         # Get the new username from the request
         new_username = request.json.get('new_username')
 
@@ -35,11 +29,16 @@ def update_username():
         if existing_user:
             return jsonify({'message': 'Username Already Exists'}), 400
 
-        # Update the username
-        user.username = new_username
+        # Update the username with one update statement, no row means the user does not exist
+        updated_user = User.query.filter_by(id=user_id).update({'username': new_username})
 
-        # Save changes to the database
+        if not updated_user:
+            db.session.rollback()
+            return jsonify({'message': 'Account Not Found'}), 404
+
+        # Save changes to the database, and drop the cached profile
         db.session.commit()
+        invalidate_user(user_id)
 
         return jsonify({'message': 'Username updated successfully.'}), 200
 
@@ -59,13 +58,6 @@ def update_email():
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
-
-        # Check the user is existed or not
-        if user is None:
-            return jsonify({'message': 'Account Not Found'}), 404
-
         # Get the new email from the request
         new_email = request.json.get('new_email')
 
@@ -75,11 +67,16 @@ def update_email():
         if existing_email:
             return jsonify({'message': 'Email Already Exists'}), 400
 
-        # Update the email
-        user.email = new_email
+        # Update the email with one update statement, no row means the user does not exist
+        updated_user = User.query.filter_by(id=user_id).update({'email': new_email})
+
+        if not updated_user:
+            db.session.rollback()
+            return jsonify({'message': 'Account Not Found'}), 404
 
-        # Save changes to the database
+        # Save changes to the database, and drop the cached profile
         db.session.commit()
+        invalidate_user(user_id)
 
         return jsonify({'message': 'Email updated successfully.'}), 200
 
@@ -99,8 +96,8 @@ def change_password():
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
+        # Retrieve the user object from the database, the password hash is never cached
+        user = db.session.get(User, user_id)
 
         # Get the old password and new password from the request
         password_data = request.json
@@ -142,12 +139,12 @@ def get_notification_enabled():
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
+        # Get the user profile, cached between requests
+        user = get_user_profile(user_id)
 
         # If has user, then get the notification_enabled value and return it
         if user:
-            notification_enabled = user.notification_enabled
+            notification_enabled = user['notification_enabled']
 
             return jsonify({'notification_enabled': notification_enabled}), 200
         else:
@@ -167,21 +164,19 @@ def update_notification_enabled():
         # Get the current user id
         user_id = get_jwt_identity()
 
-        # Retrieve the user object from the database
-        user = User.query.get(user_id)
-
-        # Check the user is existed or not
-        if user is None:
-            return jsonify({'message': 'Account Not Found'}), 404
-
         # Get the new notification enabled value from the request
         new_notification_enabled = request.json.get('notification_enabled')
 
-        # Update the notification enabled
-        user.notification_enabled = new_notification_enabled
+        # Update the notification enabled with one update statement, no row means the user does not exist
+        updated_user = User.query.filter_by(id=user_id).update({'notification_enabled': new_notification_enabled})
+
+        if not updated_user:
+            db.session.rollback()
+            return jsonify({'message': 'Account Not Found'}), 404
 
-        # Save changes to the database
+        # Save changes to the database, and drop the cached profile
         db.session.commit()
+        invalidate_user(user_id)
 
         return jsonify({'message': 'Notification enabled updated successfully.'}), 200
 
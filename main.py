@@ -1,4 +1,10 @@
+import time
+
+# Start timing the boot before importing the app, so the import time is included in the report
+boot_started = time.perf_counter()
+
 from flask_website import create_app
+from flask_website.boot_timing import BootTimer
 from flask_website.notifications import notifications
 from flask_website.auth import auth
 from flask_website.email import email
@@ -6,8 +12,11 @@ from flask_website.user_profile import user_profile
 from flask_website.expense import expense
 from flask_website.budget import budget
 
+boot_timer = BootTimer(boot_started)
+boot_timer.mark('imports')
+
 # Create the flask app
-app = create_app()
+app = create_app(boot_timer)
 
 # Register the blueprints here to avoid the circular import error in flask_website package
 app.register_blueprint(auth, url_prefix="/auth")
@@ -17,6 +26,11 @@ app.register_blueprint(user_profile, url_prefix="/user-profile")
 app.register_blueprint(expense, url_prefix="/expense")
 app.register_blueprint(budget, url_prefix="/budget")
 
+# Record and log how long the whole boot took
+boot_timer.mark('register_blueprints')
+app.config['BOOT_TIMINGS'] = boot_timer.report()
+boot_timer.log('main')
+
 # Run the script
 # if __name__ == '__main__':
 #     app.run(debug=False)
\ No newline at end of file
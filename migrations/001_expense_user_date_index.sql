@@ -0,0 +1,2 @@
+-- Composite index for the keyset pagination of GET /expense (user_id, date DESC, id DESC)
+CREATE INDEX ix_expense_user_id_date_id ON expense (user_id, date, id);
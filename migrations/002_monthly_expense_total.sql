@@ -0,0 +1,13 @@
+-- Monthly expense rollup per user and category, fill it afterwards with:
+--   flask --app main expense rebuild-rollup
+CREATE TABLE monthly_expense_total (
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    total NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    FOREIGN KEY (category_id) REFERENCES category (id)
+);
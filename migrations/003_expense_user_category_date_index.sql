@@ -0,0 +1,2 @@
+-- Composite index for the sums of a user's category over a [start, end) month window
+CREATE INDEX ix_expense_user_id_category_id_date ON expense (user_id, category_id, date);
@@ -0,0 +1,8 @@
+-- Version counters of the per-user resource lists, used for the ETag of the list endpoints
+-- A missing row is version 0, so the table starts empty
+CREATE TABLE data_version (
+    user_id INTEGER NOT NULL,
+    resource VARCHAR(30) NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, resource)
+);
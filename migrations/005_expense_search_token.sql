@@ -0,0 +1,11 @@
+-- Inverted index of the expense titles and descriptions, fill it afterwards with:
+--   flask --app main expense rebuild-search-index
+CREATE TABLE expense_search_token (
+    expense_id INTEGER NOT NULL,
+    token VARCHAR(50) NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (expense_id, token),
+    FOREIGN KEY (expense_id) REFERENCES expense (id),
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+CREATE INDEX ix_expense_search_token_user_id_token_expense_id ON expense_search_token (user_id, token, expense_id);
@@ -0,0 +1,8 @@
+-- Alert thresholds of the budgets and the highest threshold notified in the current month
+ALTER TABLE budget ADD COLUMN alert_thresholds VARCHAR(50) NULL;
+ALTER TABLE budget ADD COLUMN alert_level INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE budget ADD COLUMN alert_period INTEGER NOT NULL DEFAULT 0;
+
+-- Budgets already notified as exceeded this month should not notify again, replace 202401 by the current
+-- year and month:
+--   UPDATE budget SET alert_level = 100, alert_period = 202401 WHERE is_exceed = 1;
@@ -0,0 +1,10 @@
+-- Completed shards of the monthly prediction job, so a restarted run skips them
+CREATE TABLE prediction_shard_checkpoint (
+    period INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    shard_size INTEGER NOT NULL,
+    budgets INTEGER NOT NULL DEFAULT 0,
+    notified INTEGER NOT NULL DEFAULT 0,
+    completed_at DATETIME NULL,
+    PRIMARY KEY (period, shard)
+);
@@ -0,0 +1,15 @@
+-- Least squares sums of the monthly totals of each user's category, read by the prediction job instead of the
+-- monthly totals. The rows are created by the next run of the job
+CREATE TABLE expense_forecast_state (
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    through_period INTEGER NOT NULL DEFAULT 0,
+    n INTEGER NOT NULL DEFAULT 0,
+    sum_x BIGINT NOT NULL DEFAULT 0,
+    sum_x2 BIGINT NOT NULL DEFAULT 0,
+    sum_y NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    sum_xy NUMERIC(20, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category_id),
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    FOREIGN KEY (category_id) REFERENCES category (id)
+);
@@ -0,0 +1,7 @@
+-- Lease electing the process of the cluster that runs the scheduled jobs
+CREATE TABLE scheduler_lease (
+    name VARCHAR(50) NOT NULL,
+    holder VARCHAR(100) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    PRIMARY KEY (name)
+);
@@ -0,0 +1,3 @@
+-- The monthly sums of a user's category are read from monthly_expense_total, so no query uses this index
+-- added by 003 any more, it only slows down the writes
+DROP INDEX ix_expense_user_id_category_id_date ON expense;